@@ -1,11 +1,18 @@
 import os
+import time
+from functools import partial
 from subprocess import PIPE
-from graph2vec import run_graph2vec
 import subprocess
-from tqdm import tqdm
 import re
 import glob
-from joblib import Parallel, delayed
+import numpy as np
+from Graph import write_edgelist
+from Sampler import sample_counts
+from kronfit import fit_initiator, write_output, INITIATOR
+from scheduler import schedule, limit_memory, memory_limited
+import registry
+import tracing
+import stamps
 
 class Embedder:
     def __init__(self, args):
@@ -13,46 +20,32 @@ class Embedder:
         self.network_name = args.name
         self.step = int(args.step)
         self.nos = int(args.t)
+        self.counts = sample_counts(args)
         self.sampling_method = args.sampling
         self.embedding_method = args.embedding
+        self.kronfit_backend = args.kronfit_backend
+        self.seed = args.seed
+        self.kronfit_timeout = args.kronfit_timeout
+        self.kronfit_memory = None if args.kronfit_memory is None else args.kronfit_memory * 2 ** 20
+        self.kronfit_warm_start = args.kronfit_warm_start
+        self.kronfit_tol = args.kronfit_tol
         self.directory = self.network_name + '/'
 
 
     def embed(self):
-        if self.embedding_method == 'kroneckerPoint':
-            kronfit_jobs = []
-            input_file = self.directory + '100.edgelist'
-            output_file = self.directory + '100_output.dat'
-            kronfit_jobs.append((input_file, output_file))
-            for p in range(self.step, 100, self.step):
-                for i in range(0, self.nos):
-                    input_file = self.directory + str(p) + '/' + str(i) + '.edgelist'
-                    output_file = self.directory + str(p) + '/' + str(i) + '_output.dat'
-                    kronfit_jobs.append((input_file, output_file))
-            print("Running Kronfit for each graph")
-            Parallel(n_jobs=int((len(os.sched_getaffinity(0)) / 2)))(
-                delayed(self.kronfit)(kronfit_job)
-                for kronfit_job in tqdm(kronfit_jobs))
-            print("Kronfit Finished")
-
-            output = open(self.directory + 'kron_points.txt', 'w')
-            points = []
-            for p in range(self.step, 100, self.step):
-                for i in range(0, self.nos):
-                    output_file = self.directory + str(p) + '/' + str(i) + '_output.dat'
-                    (a, b, d) = self.read_kron_point(output_file)
-                    output.write(str(a) + ',' + str(b) + ',' + str(d) + ',' + str(p) + '\n')
-                    points.append([float(a), float(b), float(d), float(p)])
-
-            full_output_file = self.directory + '100_output.dat'
-            (a, b, d) = self.read_kron_point(full_output_file)
-            output.write(str(a) + ',' + str(b) + ',' + str(d) + ',' + str(100) + '\n')
-            points.append([float(a), float(b), float(d), float(100)])
-            output.close()
-            return points
-
-        elif self.embedding_method == 'graph2vec':
-            return run_graph2vec(self.args)
+        # graph2vec and wlsvd are only imported when selected, see registry
+        return registry.load('embedding', self.embedding_method)(self.args)
+
+    def embed_kronecker(self):
+        print("Running Kronfit for each graph")
+        if self.kronfit_warm_start:
+            # the sample fits start from the initiator of the full graph fit
+            self.run_kronfit([self.full_kronfit_job()])
+            self.run_kronfit(self.sample_kronfit_jobs())
+        else:
+            self.run_kronfit([self.full_kronfit_job()] + self.sample_kronfit_jobs())
+        print("Kronfit Finished")
+        return self.kron_points()
 
     # def kronfit(self, kronfit_job):
     #     #     input_file_path = kronfit_job[0]
@@ -62,12 +55,120 @@ class Embedder:
     #     #     if not os.path.exists(output_file_path):
     #     #         cmd = 'kronfit', '-i:' + input_file_path, '-n0:2', '-gi:20', '-o:' + output_file_path
     #     #         subprocess.Popen(cmd, stdout=PIPE).communicate()
-    def kronfit(self, kronfit_job):
-        input_file_path = kronfit_job[0]
-        output_file_path = kronfit_job[1]
-        if not os.path.exists(output_file_path):
+    def full_kronfit_job(self):
+        # (sample .npy, text edge list for the kronfit binary, output, initial initiator)
+        return (self.directory + '100.npy', self.directory + '100.edgelist', self.directory + '100_output.dat', None)
+
+    def sample_kronfit_jobs(self):
+        # every sample starts from the full graph fit, so the start does not depend on which samples ran before
+        init = self.full_initiator() if self.kronfit_warm_start else None
+        jobs = []
+        for p in self.counts:
+            for i in range(0, self.counts[p]):
+                sample_file = self.directory + str(p) + '/' + str(i) + '.npy'
+                input_file = self.directory + str(p) + '/' + str(i) + '.edgelist'
+                output_file = self.directory + str(p) + '/' + str(i) + '_output.dat'
+                jobs.append((sample_file, input_file, output_file, init))
+        return jobs
+
+    def run_kronfit(self, kronfit_jobs):
+        manifest_path = self.directory + 'kronfit_manifest.json'
+        failed = schedule(self.kronfit, kronfit_jobs,
+                          keys=[job[2] for job in kronfit_jobs],
+                          sizes=[np.load(job[0], mmap_mode='r').shape[0] for job in kronfit_jobs],
+                          manifest_path=manifest_path,
+                          timeout=self.kronfit_timeout,
+                          memory_limit=self.kronfit_memory,
+                          output_keys=[self.kronfit_key(job) for job in kronfit_jobs])
+        if failed:
+            raise RuntimeError('Kronfit failed for {} graphs ({}), see {}. Rerun to retry them.'.format(
+                len(failed), ', '.join(sorted(failed)), manifest_path))
+
+    def kron_points(self):
+        # collects the fitted points of the samples and the full graph into kron_points.txt
+        output = open(self.directory + 'kron_points.txt', 'w')
+        points = []
+        for p in self.counts:
+            for i in range(0, self.counts[p]):
+                output_file = self.directory + str(p) + '/' + str(i) + '_output.dat'
+                (a, b, d) = self.read_kron_point(output_file)
+                output.write(str(a) + ',' + str(b) + ',' + str(d) + ',' + str(p) + '\n')
+                points.append([float(a), float(b), float(d), float(p)])
+
+        full_output_file = self.directory + '100_output.dat'
+        (a, b, d) = self.read_kron_point(full_output_file)
+        output.write(str(a) + ',' + str(b) + ',' + str(d) + ',' + str(100) + '\n')
+        points.append([float(a), float(b), float(d), float(100)])
+        output.close()
+        return points
+
+    def kronfit_key(self, kronfit_job):
+        # a fit is redone when its sample was redrawn or any setting of the fit changed
+        sample_file_path, input_file_path, output_file_path, init = kronfit_job
+        warm_start = None if init is None else ([float(x) for x in init], self.kronfit_tol)
+        options = (self.kronfit_backend, self.seed, warm_start)
+        return stamps.key('kronfit', stamps.read(sample_file_path), options)
+
+    def full_initiator(self):
+        # only a stamped fit, an output left over from an interrupted or stale fit is never a start
+        full_output_file = self.directory + '100_output.dat'
+        if stamps.read(full_output_file) is None:
+            raise RuntimeError('{} is not fitted, warm-started sample fits need it first'.format(full_output_file))
+        return self.read_initiator(full_output_file)
+
+    def sample_index(self, output_file_path):
+        # (p, i) of <name>/<p>/<i>_output.dat, the full graph <name>/100_output.dat is (100, 0)
+        parent, name = os.path.split(output_file_path)
+        if os.path.normpath(parent) == os.path.normpath(self.directory):
+            return 100, 0
+        return int(os.path.basename(parent)), int(name[:-len('_output.dat')])
+
+    def kronfit(self, kronfit_job, timeout=None, memory_limit=None, edges=None):
+        # edges of the sample can be handed over in memory, e.g. by the sampler that just drew it
+        if edges is None:
+            edges = np.load(kronfit_job[0], mmap_mode='r')
+        with tracing.span('kronfit', graph=kronfit_job[0], backend=self.kronfit_backend,
+                          warm_start=kronfit_job[3] is not None, edges=len(edges)):
+            return self.run_kronfit_job(kronfit_job, timeout, memory_limit, edges)
+
+    def run_kronfit_job(self, kronfit_job, timeout=None, memory_limit=None, edges=None):
+        sample_file_path = kronfit_job[0]
+        input_file_path = kronfit_job[1]
+        output_file_path = kronfit_job[2]
+        init = kronfit_job[3]
+        if edges is None:
+            edges = np.load(sample_file_path, mmap_mode='r')
+        if self.kronfit_backend == 'native':
+            # like the samples, the seed of a fit only depends on (seed, p, i), not on the directory of the run
+            seed = None if self.seed is None else [int(self.seed)] + list(self.sample_index(output_file_path))
+            deadline = None if timeout is None else time.monotonic() + timeout
+            if init is None:
+                options = {'init': INITIATOR}
+            else:
+                # a warm start is already close, small steps and a convergence test replace the fixed budget
+                options = {'init': init, 'max_step': 0.01, 'tol': self.kronfit_tol}
+            with memory_limited(memory_limit):
+                point, theta, log_likelihood = fit_initiator(edges, np.random.default_rng(seed), iterations=100,
+                                                             deadline=deadline, **options)
+            write_output(output_file_path, theta, edges, log_likelihood)
+            return point
+        else:
+            # the kronfit binary only reads text edge lists
+            edgelist_key = stamps.key('edgelist', stamps.read(sample_file_path))
+            if not stamps.is_fresh(input_file_path, edgelist_key):
+                stamps.invalidate(input_file_path)
+                write_edgelist(input_file_path, edges)
+                stamps.write(input_file_path, edgelist_key)
+            if os.path.exists(output_file_path):
+                os.remove(output_file_path)
             cmd = 'kronfit', '-i:' + input_file_path, '-n0:2', '-gi:100', '-o:' + output_file_path
-            subprocess.Popen(cmd, stdout=subprocess.PIPE).communicate()
+            if init is not None:
+                cmd += ('-m:{} {}; {} {}'.format(*init),)
+            result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout,
+                                    preexec_fn=partial(limit_memory, memory_limit))
+            if result.returncode != 0 or not os.path.exists(output_file_path):
+                raise RuntimeError('kronfit exited with code {}: {}'.format(
+                    result.returncode, result.stderr.decode(errors='replace')))
 
     def read_kron_point(self, output_file):
         with open(output_file, 'r') as myfile:
@@ -79,3 +180,18 @@ class Embedder:
             d = split[2].strip()
 
         return (a, b, d)
+
+    def read_initiator(self, output_file):
+        with open(output_file, 'r') as myfile:
+            s = myfile.read()
+            ret = re.findall(r'\[([^]]*)\]', s)
+        return [float(x) for x in ret[0].replace(';', ',').split(',')]
+
+
+def run_kronecker(args):
+    """
+    Main function to embed the samples as the fitted Kronecker initiators.
+    :param args: Object with the arguments.
+    :return points: List of [a, b, d, sampling_proportion].
+    """
+    return Embedder(args).embed_kronecker()
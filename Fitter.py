@@ -1,6 +1,14 @@
 import os, shutil
-import matlab.engine
 import glob
+import numpy as np
+from scipy.spatial import QhullError
+import geometry
+import registry
+import tracing
+import stamps
+
+ERROR_MESSAGE = 'Error computing the cuboid/convex hull. The points may be coplanar or collinear. ' \
+                'Please see the kron_points.txt for the points.'
 
 class Fitter:
     def __init__(self, args):
@@ -11,24 +19,56 @@ class Fitter:
         self.sampling_method = args.sampling
         self.embedding_method = args.embedding
         self.fitting_method = args.fitting
+        self.fitting_backend = args.fitting_backend
         self.directory = self.network_name + '/' + self.embedding_method + '/'
-        if os.path.isdir(self.directory):
-            shutil.rmtree(self.directory)
-        os.mkdir(self.directory)
         self.zip = args.zip
 
 
-    def fit(self, points):
+    def fit(self, points, eng=None):
+        """
+        :param points: List of [x1, x2, x3, sampling_proportion].
+        :param eng: A running MATLAB engine to reuse with the matlab backend, by default one is started.
+        """
+        # the shapes only depend on the points and the fitting settings, unchanged points are not refitted
+        output_key = stamps.key('fit', self.fitting_backend, [list(map(float, point)) for point in points])
+        if stamps.is_fresh(self.directory, output_key):
+            print('{} shapes are up to date'.format(self.embedding_method))
+            return
+        stamps.invalidate(self.directory)
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        os.mkdir(self.directory)
+        registry.load('fitting', self.fitting_backend)(self, points, eng)
+        stamps.write(self.directory, output_key)
 
+    def fit_matlab(self, points, eng=None):
+        # one engine for all three fits, starting it takes tens of seconds
+        own_engine = eng is None
+        if own_engine:
+            eng = start_matlab()
         # if self.fitting_method == 'convexhull':
-        self.create_kronecker_hull(self.directory, points, self.network_name)
+        self.create_kronecker_hull(eng, self.directory, points, self.network_name)
         # elif self.fitting_method == 'cuboid':
-        self.create_cuboid(self.directory, points, self.network_name)
+        self.create_cuboid(eng, self.directory, points, self.network_name)
         # elif self.fitting_method == 'sphere':
-        self.create_sphere(self.directory, points, self.network_name)
+        self.create_sphere(eng, self.directory, points, self.network_name)
+        if own_engine:
+            eng.quit()
+
+    def fit_native(self, points, eng=None):
+        xyz = np.asarray(points, dtype=float)[:, :3]
+        with tracing.span('fit_hull', points=len(xyz)):
+            self.fit_kronecker_hull(self.directory, xyz)
+        with tracing.span('fit_cuboid', points=len(xyz)):
+            self.fit_cuboid(self.directory, xyz)
+        with tracing.span('fit_sphere', points=len(xyz)):
+            self.fit_sphere(self.directory, xyz)
 
+    def zip_shapes(self):
+        # after rendering, so the plots of the native backend are part of the archive
         if self.zip:
             # makes new directory network_shape and copies them to it
+            shutil.rmtree(self.directory + 'network_shape', ignore_errors=True)
             os.mkdir(self.directory + '/' + 'network_shape' + '/')
             # shutil.copy2(self.directory + '/' + 'boundary.txt', self.directory + '/' + 'network_shape' + '/')
             # shutil.copy2(self.directory + '/' + 'center_radius.txt', self.directory + '/' + 'network_shape' + '/')
@@ -49,14 +89,71 @@ class Fitter:
             # zips network_shape directory
             shutil.make_archive(self.directory + 'network_shape', 'zip', self.directory + 'network_shape')
 
-    def create_kronecker_hull(self, directory, points, display_name):
-        eng = matlab.engine.start_matlab()
+    def create_kronecker_hull(self, eng, directory, points, display_name):
+        import matlab
         eng.get_convex_hull(matlab.double(points), directory, display_name)
 
-    def create_cuboid(self, directory, points, display_name):
-        eng = matlab.engine.start_matlab()
+    def create_cuboid(self, eng, directory, points, display_name):
+        import matlab
         eng.get_cuboid(matlab.double(points), directory, display_name)
 
-    def create_sphere(self, directory, points, display_name):
-        eng = matlab.engine.start_matlab()
+    def create_sphere(self, eng, directory, points, display_name):
+        import matlab
         eng.get_sphere(matlab.double(points), directory, display_name)
+
+    # same outputs as get_convex_hull.m, get_cuboid.m and get_sphere.m, without the figures
+    def fit_kronecker_hull(self, directory, xyz):
+        try:
+            vertices, volume, area = geometry.convex_hull(xyz)
+        except QhullError:
+            self.write_error(directory)
+            return
+        np.savetxt(directory + 'boundary.txt', vertices, delimiter=',', fmt='%.15g')
+
+    def fit_cuboid(self, directory, xyz):
+        try:
+            rotmat, cornerpoints, volume, surface, edgelength = geometry.min_bound_box(xyz)
+        except QhullError:
+            self.write_error(directory)
+            return
+        np.savetxt(directory + 'corner_points.txt', cornerpoints, delimiter=',', fmt='%.15g')
+
+    def fit_sphere(self, directory, xyz):
+        center, radius = geometry.sphere_fit(xyz)
+        np.savetxt(directory + 'center_radius.txt', np.append(center, radius)[None, :], delimiter=',', fmt='%.15g')
+
+    def write_error(self, directory):
+        with open(directory + 'error.log', 'w') as f:
+            f.write(ERROR_MESSAGE)
+
+
+def start_matlab():
+    import matlab.engine
+    with tracing.span('matlab_start'):
+        return matlab.engine.start_matlab()
+
+
+def read_shape(directory):
+    """
+    Function to read the parameters of the shapes fitted in a directory, by either backend.
+    :param directory: Output directory of a Fitter, e.g. <name>/kroneckerPoint/.
+    :return shape: Dictionary with hull_volume, hull_area, box_edges (longest first), box_volume,
+                   sphere_center and sphere_radius, NaN for a shape that is missing.
+    """
+    shape = {'hull_volume': np.nan, 'hull_area': np.nan, 'box_edges': np.full(3, np.nan), 'box_volume': np.nan,
+             'sphere_center': np.full(3, np.nan), 'sphere_radius': np.nan}
+    if os.path.isfile(directory + 'boundary.txt'):
+        try:
+            vertices, shape['hull_volume'], shape['hull_area'] = geometry.convex_hull(
+                np.loadtxt(directory + 'boundary.txt', delimiter=',', ndmin=2)[:, :3])
+        except QhullError:
+            pass
+    if os.path.isfile(directory + 'corner_points.txt'):
+        corners = np.loadtxt(directory + 'corner_points.txt', delimiter=',', ndmin=2)[:, :3]
+        # corners 1, 3 and 4 are the neighbors of corner 0, as in minboundbox
+        shape['box_edges'] = np.sort(np.linalg.norm(corners[[1, 3, 4]] - corners[0], axis=1))[::-1]
+        shape['box_volume'] = np.prod(shape['box_edges'])
+    if os.path.isfile(directory + 'center_radius.txt'):
+        center_radius = np.loadtxt(directory + 'center_radius.txt', delimiter=',', ndmin=2)[0]
+        shape['sphere_center'], shape['sphere_radius'] = center_radius[:3], center_radius[3]
+    return shape
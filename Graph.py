@@ -0,0 +1,188 @@
+import os
+import glob
+import hashlib
+import numpy as np
+
+CACHE_ARRAYS = ['edges', 'node_ids', 'indptr', 'indices']
+
+
+class Graph:
+    """
+    Undirected graph stored as CSR arrays over contiguous int32 node ids.
+    """
+    def __init__(self, edges, node_ids=None):
+        """
+        :param edges: Array of shape (m, 2) with contiguous integer node ids.
+        :param node_ids: Original label of each node, defaults to the ids themselves.
+        """
+        edges = canonical_edges(edges)
+        if node_ids is None:
+            node_ids = np.arange(edges.max() + 1 if len(edges) else 0)
+        self.edges = edges
+        self.node_ids = node_ids
+        self.n = len(node_ids)
+        self.m = len(edges)
+        self.indptr, self.indices = csr(edges, self.n)
+
+    @classmethod
+    def load(cls, path, cache_dir, delimiter='\t'):
+        """
+        Reading an edge list through a binary cache keyed by the content hash of the file.
+        The cached arrays are memory-mapped, a changed file gets a new key and replaces the old cache.
+        :param path: Path to the edge list.
+        :param cache_dir: Directory holding the cached .npy arrays.
+        :param delimiter: Column delimiter.
+        :return graph: The Graph object.
+        """
+        digest = file_hash(path)
+        prefix = os.path.join(cache_dir, digest + '.')
+        if not all(os.path.isfile(prefix + name + '.npy') for name in CACHE_ARRAYS):
+            graph = cls.read_edgelist(path, delimiter)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            for stale in glob.glob(os.path.join(cache_dir, '*.npy')):
+                os.remove(stale)
+            for name in CACHE_ARRAYS:
+                # write then rename, so an interrupted run never leaves a truncated cache behind
+                tmp_path = prefix + name + '.tmp.npy'
+                np.save(tmp_path, getattr(graph, name))
+                os.replace(tmp_path, prefix + name + '.npy')
+
+        # always hand out the memory-mapped arrays, worker processes then share them instead of copies
+        graph = cls.__new__(cls)
+        for name in CACHE_ARRAYS:
+            setattr(graph, name, np.load(prefix + name + '.npy', mmap_mode='r'))
+        graph.n = len(graph.node_ids)
+        graph.m = len(graph.edges)
+        # identifies the input of everything computed from this graph
+        graph.content_hash = digest
+        return graph
+
+    @classmethod
+    def read_edgelist(cls, path, delimiter='\t'):
+        """
+        Reading a text edge list, relabeling the nodes to contiguous ids in order of appearance.
+        :param path: Path to the edge list.
+        :param delimiter: Column delimiter.
+        :return graph: The Graph object.
+        """
+        import pandas as pd
+        data = pd.read_csv(path, sep=delimiter, comment='#', header=None, usecols=[0, 1],
+                           dtype=str, engine='c')
+        codes, node_ids = pd.factorize(data.values.ravel())
+        return cls(codes.reshape(-1, 2), np.asarray(node_ids).astype(str))
+
+    @classmethod
+    def from_edges(cls, edges):
+        """
+        Building a graph from arbitrary integer edges, e.g. a sample of a parent graph.
+        :param edges: Array of shape (m, 2).
+        :return graph: The Graph object with the original ids kept in node_ids.
+        """
+        node_ids, codes = np.unique(np.asarray(edges), return_inverse=True)
+        return cls(codes.reshape(-1, 2), node_ids)
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def neighbors(self, node):
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def induced_edges(self, node_mask):
+        """
+        :param node_mask: Boolean array over the nodes.
+        :return edges: The edges with both end points in the mask.
+        """
+        return self.edges[node_mask[self.edges[:, 0]] & node_mask[self.edges[:, 1]]]
+
+    def to_networkx(self, edges=None):
+        """
+        Building a networkx graph with the original labels, only for callers that need one.
+        :param edges: Optional subset of the edges, defaults to the whole graph.
+        :return graph: The networkx Graph.
+        """
+        import networkx as nx
+        graph = nx.Graph()
+        if edges is None:
+            graph.add_nodes_from(self.node_ids.tolist())
+            edges = self.edges
+        graph.add_edges_from(self.node_ids[edges].tolist())
+        return graph
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    Function to compute the md5 hexdigest of a file's content.
+    :param path: Path to the file.
+    :param chunk_size: Bytes read at a time.
+    :return digest: The hexdigest.
+    """
+    hash_object = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hash_object.update(chunk)
+    return hash_object.hexdigest()
+
+
+def mix64(x):
+    """
+    Function to scramble uint64 labels with the splitmix64 finalizer.
+    :param x: Array of uint64.
+    :return x: Array of uint64.
+    """
+    with np.errstate(over='ignore'):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def canonical_edges(edges):
+    """
+    Function to turn edges into unique (min, max) pairs, as in an undirected networkx graph.
+    :param edges: Array of shape (m, 2).
+    :return edges: Sorted unique int32 array of shape (m', 2).
+    """
+    edges = np.sort(np.asarray(edges, dtype=np.int32).reshape(-1, 2), axis=1)
+    # sorting one int64 key per edge is much faster than np.unique(axis=0)
+    keys = np.sort(edges[:, 0].astype(np.int64) << 32 | edges[:, 1])
+    keys = keys[np.concatenate([keys[:1] == keys[:1], keys[1:] != keys[:-1]])]
+    return np.stack([keys >> 32, keys & 0xFFFFFFFF], axis=1).astype(np.int32)
+
+
+def directed_edges(edges):
+    """
+    Function to list each undirected edge in both directions, as nx.Graph.to_directed() does.
+    :param edges: Canonical edges.
+    :return edges: Directed edges, self loops listed once.
+    """
+    loops = edges[:, 0] == edges[:, 1]
+    return np.concatenate([edges, edges[~loops][:, ::-1]])
+
+
+def write_edgelist(path, edges, delimiter='\t'):
+    """
+    Function to write edges in both directions as a text edge list, in one vectorized pass.
+    :param path: Path to the edge list.
+    :param edges: Canonical edges.
+    :param delimiter: Column delimiter.
+    """
+    import pandas as pd
+    directed = directed_edges(np.asarray(edges))
+    pd.DataFrame(directed).to_csv(path, sep=delimiter, header=False, index=False)
+
+
+def csr(edges, n):
+    """
+    Function to build the CSR neighbor arrays of an undirected edge array.
+    :param edges: Canonical edges.
+    :param n: Number of nodes.
+    :return indptr: Offsets into indices, of length n + 1.
+    :return indices: Concatenated neighbor lists.
+    """
+    directed = directed_edges(edges)
+    order = np.argsort(directed[:, 0], kind='stable')
+    indices = directed[order, 1]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(directed[:, 0], minlength=n), out=indptr[1:])
+    return indptr, indices
@@ -1,7 +1,11 @@
-import random, os
-import networkx as nx
-import os.path
-from os import path
+import os
+import numpy as np
+from tqdm import tqdm
+from joblib import Parallel, delayed
+from Graph import Graph
+import registry
+import tracing
+import stamps
 
 
 class Sampler:
@@ -9,115 +13,180 @@ class Sampler:
         self.args = args
         self.network_name = args.name
         self.edgelist = args.file
-        self.G = nx.read_edgelist(self.edgelist, delimiter='\t')
-        self.nodes = list(self.G.nodes())
         self.step = int(args.step)
         self.nos = int(args.t)
         self.sampling_method = args.sampling
+        # looked up here rather than in the workers, which do not see backends registered at run time
+        self.sample_method = registry.load('sampling', self.sampling_method)
         self.embedding_method = args.embedding
         self.directory = self.network_name + '/'
-
+        self.graph = Graph.load(self.edgelist, self.directory + 'cache/', delimiter='\t')
+        self.seed = args.seed
+        self.nested = args.nested
 
     def sample(self):
-        # if self.embedding_method == 'kroneckerPoint':
-        if not path.isfile(self.directory + '100.edgelist'):
-            nx.write_edgelist(self.G.to_directed(), self.directory + '100.edgelist', delimiter='\t', data=False)
-        #elif self.embedding_method == 'graph2vec':
-        json_path = self.directory + '100.json'
-        if not path.isfile(json_path):
-            self.write_json(json_path, self.G.to_directed())
+        self.write_full()
         # get sample graphs
-        for p in range(self.step, 100, self.step):
-            print('Sampling ' + str(p) + '% subgraphs')
+        sample_jobs = []
+        counts = sample_counts(self.args)
+        for p in counts:
             if not os.path.isdir(self.directory + str(p) + '/'):
                 os.mkdir(self.directory + str(p) + '/')
-            for i in range(0, self.nos):
-                sample_file = self.directory + str(p) + '/' + str(i) + '.edgelist'
-                if path.isfile(sample_file):
+            for i in range(0, counts[p]):
+                sample_file = self.directory + str(p) + '/' + str(i) + '.npy'
+                if stamps.is_fresh(sample_file, self.sample_key(p, i)):
                     continue
-                if self.sampling_method == 'randomEdge':
-                    self.random_edge_sampling(self.directory, p, i)
-                elif self.sampling_method == 'randomNode':
-                    self.random_node_sampling(self.directory, p, i)
-                elif self.sampling_method == 'randomWalk':
-                    self.random_walk_with_restart_sampling(self.directory, p, i)
+                sample_jobs.append((p, i))
+        print('Sampling {} subgraphs'.format(len(sample_jobs)))
+        # the graph arrays are memory-mapped, so the workers share them instead of receiving copies
+        if self.nested:
+            # one job per replicate, all its proportions are prefixes of the same random order
+            replicates = sorted(set(i for (p, i) in sample_jobs))
+            Parallel(n_jobs=max(1, int(len(os.sched_getaffinity(0)) / 2)))(
+                delayed(self.nested_sample_job)(i, [p for (p, j) in sample_jobs if j == i])
+                for i in tqdm(replicates))
+        else:
+            Parallel(n_jobs=max(1, int(len(os.sched_getaffinity(0)) / 2)))(
+                delayed(self.sample_job)(p, i) for (p, i) in tqdm(sample_jobs))
+
+    def write_full(self):
+        full_key = stamps.key('graph', self.graph.content_hash)
+        if not stamps.is_fresh(self.directory + '100.npy', full_key):
+            stamps.invalidate(self.directory + '100.npy')
+            self.write_npy(self.directory + '100.npy', self.graph.edges)
+            stamps.write(self.directory + '100.npy', full_key)
+
+    def sample_key(self, p, i):
+        # a sample is reused only if it was drawn from the same graph with the same method and seed
+        return stamps.key('sample', self.graph.content_hash, self.sampling_method, self.seed, self.nested, p, i)
+
+    def sample_job(self, p, i):
+        # the seed of each sample only depends on (seed, p, i), not on the worker running it
+        rng = np.random.default_rng(None if self.seed is None else [int(self.seed), p, i])
+        with tracing.span('sample', method=self.sampling_method, p=p, i=i):
+            self.sample_method(self, self.directory, p, i, rng=rng)
+
+    def nested_sample_job(self, i, proportions):
+        # the seed only depends on (seed, i), so the proportions of a replicate stay nested across reruns
+        rng = np.random.default_rng(None if self.seed is None else [int(self.seed), i])
+        with tracing.span('nested_sample', method=self.sampling_method, i=i, proportions=len(proportions)):
+            self.nested_sample(i, proportions, rng)
+
+    def nested_sample(self, i, proportions, rng):
+        if self.sampling_method == 'randomEdge':
+            order = rng.permutation(self.graph.m)
+            for p in proportions:
+                size = self.graph.m - int(self.graph.m * float(100 - p) / 100)
+                self.write(self.graph.edges[order[:size]], self.directory, p, i)
+        elif self.sampling_method in ('randomNode', 'randomWalk'):
+            if self.sampling_method == 'randomNode':
+                nodelist = rng.permutation(self.graph.n)
+            else:
+                # the walk visits nodes in order, a shorter walk is a prefix of a longer one
+                nodelist = random_walk_with_restart(self.graph, int(self.graph.n * float(max(proportions)) / 100), rng)
+            # an edge enters the sample once both its end points did, edges are kept in that order
+            rank = np.full(self.graph.n, self.graph.n, dtype=np.int64)
+            rank[nodelist] = np.arange(len(nodelist))
+            edge_rank = np.maximum(rank[self.graph.edges[:, 0]], rank[self.graph.edges[:, 1]])
+            order = np.argsort(edge_rank, kind='stable')
+            edge_rank = edge_rank[order]
+            for p in proportions:
+                size = int(self.graph.n * float(p) / 100)
+                self.write(self.graph.edges[order[:np.searchsorted(edge_rank, size)]], self.directory, p, i)
+        else:
+            raise ValueError('{} sampling does not support -nested'.format(self.sampling_method))
 
     # sample a subgraph
-    def random_node_sampling(self, directory, p, i):
-        random.shuffle(self.nodes)
-        size = int(len(self.nodes) * float(p) / 100)
-        sample = self.nodes[:size]
-        sub_g = self.G.subgraph(sample)
-        sub_g = sub_g.to_directed()  # Forgot to add
-        self.write(sub_g, directory, p, i)
-
-    def random_edge_sampling(self, directory, p, i):
-        sub_g = self.G.copy()
-        edges = [e for e in sub_g.edges]
-        random.shuffle(edges)
-        size = int(len(edges) * float(100 - p) / 100)
-        sub_g.remove_edges_from(edges[:size])
-        sub_g = sub_g.to_directed()  # Forgot to add
-        self.write(sub_g, directory, p, i)
-
-    def random_walk_with_restart_sampling(self, directory, p, i, restart_prob=0.15, jump_iteration=10, seed=None):
-        # set random seed
-        random.seed(seed)
+    def random_node_sampling(self, directory, p, i, rng):
+        size = int(self.graph.n * float(p) / 100)
+        node_mask = np.zeros(self.graph.n, dtype=bool)
+        node_mask[rng.permutation(self.graph.n)[:size]] = True
+        self.write(self.graph.induced_edges(node_mask), directory, p, i)
 
+    def random_edge_sampling(self, directory, p, i, rng):
+        size = int(self.graph.m * float(100 - p) / 100)
+        edge_mask = np.ones(self.graph.m, dtype=bool)
+        edge_mask[rng.permutation(self.graph.m)[:size]] = False
+        self.write(self.graph.edges[edge_mask], directory, p, i)
+
+    def random_walk_with_restart_sampling(self, directory, p, i, restart_prob=0.15, jump_iteration=10, rng=None):
         # sample size round down to interger
-        sample_size = int(len(self.nodes) * float(p) / 100)
-
-        # set starting node
-        startnode = random.choice(self.nodes)
-        currentnode = startnode
-
-        # used for jump when no new node visited in certain iteration
-        restart_iteration = 0
-        last_number_of_nodes = 0
-
-        # result node set and total iteration
-        nodelist = set()
-        total_iteration = 0
-        while len(nodelist) < sample_size:
-            # add current node
-            total_iteration += 1
-            nodelist.add(currentnode)
-            # restart with certain prob
-            x = random.random()
-            if x < restart_prob:
-                currentnode = startnode
-            else:
-                # move a step forward
-                nextnode = random.choice(list(self.G[currentnode]))
-                currentnode = nextnode
-            # find a new startnode if number of nodes in sample does not grow
-            if restart_iteration < jump_iteration:
-                restart_iteration += 1
-            else:
-                if last_number_of_nodes == len(nodelist):
-                    startnode = random.choice(self.nodes)
-                    currentnode = startnode
-                restart_iteration = 0
-                last_number_of_nodes = len(nodelist)
-        sub_g = self.G.subgraph(nodelist).to_directed()
-        self.write(sub_g, directory, p, i)
-
-    def write(self, sub_g, directory, p, i):
-        # if self.embedding_method == 'kroneckerPoint':
-        nx.write_edgelist(sub_g, directory + str(p) + '/'
-                              + str(i) + '.edgelist', delimiter='\t', data=False)
-        # elif self.embedding_method == 'graph2vec':
-        json_path = directory + str(p) + '/' + str(i) + '.json'
-        self.write_json(json_path, sub_g)
-
-    def write_json(self, json_path, graph):
-        length = len(graph.edges())
-        with open(json_path, 'w') as output_file:
-            output_file.write('{"edges": [')
-            for index, edge in enumerate(graph.edges()):
-                n1, n2 = edge
-                if index < length - 1:
-                    output_file.write('[{}, {}],'.format(n1, n2))
-                else:
-                    output_file.write('[{}, {}]'.format(n1, n2))
-            output_file.write(']}')
+        sample_size = int(self.graph.n * float(p) / 100)
+        if rng is None:
+            rng = np.random.default_rng(self.seed)
+        nodelist = random_walk_with_restart(self.graph, sample_size, rng, restart_prob, jump_iteration)
+        node_mask = np.zeros(self.graph.n, dtype=bool)
+        node_mask[nodelist] = True
+        self.write(self.graph.induced_edges(node_mask), directory, p, i)
+
+    def write(self, edges, directory, p, i):
+        # one int32 edge array per sample, text edge lists for kronfit are written by the Embedder on demand
+        sample_file = directory + str(p) + '/' + str(i) + '.npy'
+        with tracing.span('write_sample', p=p, i=i, edges=len(edges)):
+            stamps.invalidate(sample_file)
+            self.write_npy(sample_file, edges)
+            stamps.write(sample_file, self.sample_key(p, i))
+
+    def write_npy(self, npy_path, edges):
+        # write then rename, so a sample file that exists is always complete
+        tmp_path = npy_path[:-len('.npy')] + '.tmp.npy'
+        np.save(tmp_path, np.asarray(edges, dtype=np.int32))
+        os.replace(tmp_path, npy_path)
+
+def sample_counts(args):
+    """
+    Function to list the sampling proportions with their number of samples.
+    :param args: Object with the arguments.
+    :return counts: Dictionary proportion -> number of samples, -t for each unless adaptive sampling set them.
+    """
+    counts = getattr(args, 'sample_counts', None)
+    if counts is None:
+        counts = {p: int(args.t) for p in range(int(args.step), 100, int(args.step))}
+    return counts
+
+def random_walk_with_restart(graph, sample_size, rng, restart_prob=0.15, jump_iteration=10, walkers=64):
+    """
+    Function to sample nodes with many independent random walks with restart advanced together.
+    :param graph: The Graph object.
+    :param sample_size: Number of nodes to visit.
+    :param rng: The numpy random Generator.
+    :param restart_prob: Probability of going back to the start node at each step.
+    :param jump_iteration: A walker that visits no new node in this many steps jumps to a new start node.
+    :param walkers: Number of walkers.
+    :return nodelist: Array of the visited nodes, in order of first visit.
+    """
+    degree = graph.degree()
+    visited = np.zeros(graph.n, dtype=bool)
+    nodelist = np.empty(sample_size, dtype=np.int64)
+    count = 0
+
+    startnode = rng.integers(graph.n, size=walkers)
+    currentnode = startnode.copy()
+    # new nodes visited by each walker since its last jump check
+    found = np.zeros(walkers, dtype=np.int64)
+    iteration = 0
+    while count < sample_size:
+        # add current nodes, a node reached by several walkers counts for the first one
+        new = ~visited[currentnode]
+        new_nodes, first = np.unique(currentnode[new], return_index=True)
+        order = np.argsort(first)[:sample_size - count]
+        new_nodes = new_nodes[order]
+        visited[new_nodes] = True
+        nodelist[count:count + len(new_nodes)] = new_nodes
+        count += len(new_nodes)
+        found += np.bincount(np.flatnonzero(new)[first[order]], minlength=walkers)
+
+        # restart with certain prob, otherwise move a step forward
+        restart = (rng.random(walkers) < restart_prob) | (degree[currentnode] == 0)
+        offset = (rng.random(walkers) * degree[currentnode]).astype(np.int64)
+        nextnode = graph.indices[np.minimum(graph.indptr[currentnode] + offset, len(graph.indices) - 1)]
+        currentnode = np.where(restart, startnode, nextnode)
+
+        # find a new startnode for the walkers whose number of visited nodes does not grow
+        iteration += 1
+        if iteration % jump_iteration == 0:
+            stuck = found == 0
+            startnode[stuck] = rng.integers(graph.n, size=stuck.sum())
+            currentnode[stuck] = startnode[stuck]
+            found[:] = 0
+    return nodelist
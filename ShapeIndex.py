@@ -0,0 +1,178 @@
+import os
+import json
+import argparse
+import numpy as np
+from scipy.spatial import cKDTree
+from Fitter import read_shape
+
+DESCRIPTORS = ['hull_volume', 'hull_area', 'box_edge_1', 'box_edge_2', 'box_edge_3', 'box_volume',
+               'sphere_radius', 'mean_x1', 'mean_x2', 'mean_x3', 'std_x1', 'std_x2', 'std_x3',
+               'skew_x1', 'skew_x2', 'skew_x3']
+
+POINTS_FILES = {'kroneckerPoint': 'kron_points.txt', 'graph2vec': 'g2v_points.txt', 'wlsvd': 'wlsvd_points.txt'}
+
+
+def read_points(name, embedding):
+    """
+    Function to read the embedded points of a network.
+    :return points: Array of shape (points, 4), NaN rows if the network has none.
+    """
+    path = name + '/' + POINTS_FILES[embedding]
+    if not os.path.isfile(path):
+        return np.full((1, 4), np.nan)
+    # only the kron points have no header
+    return np.loadtxt(path, delimiter=',', skiprows=int(embedding != 'kroneckerPoint'), ndmin=2)
+
+
+def describe(name, embedding):
+    """
+    Function to compute the shape descriptors of a network, in the order of DESCRIPTORS.
+    :param name: Output directory of the network.
+    :param embedding: Embedding whose shapes are described.
+    :return descriptor: Array of length len(DESCRIPTORS), NaN for missing values.
+    """
+    shape = read_shape(name + '/' + embedding + '/')
+    xyz = read_points(name, embedding)[:, :3]
+    mean = xyz.mean(axis=0)
+    std = xyz.std(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        skew = ((xyz - mean) ** 3).mean(axis=0) / std ** 3
+    skew[std == 0] = 0
+    return np.concatenate([[shape['hull_volume'], shape['hull_area']], shape['box_edges'],
+                           [shape['box_volume'], shape['sphere_radius']], mean, std, skew])
+
+
+class ShapeIndex:
+    """
+    Nearest-network search over the fitted shapes of a dataset.
+    Every network is a vector of shape descriptors, standardized per descriptor so that volumes and
+    coordinates weigh alike, and queried through a KD-tree.
+    """
+    def __init__(self, names, descriptors, embedding, weights=None):
+        """
+        :param names: Network names.
+        :param descriptors: Array of shape (networks, len(DESCRIPTORS)).
+        :param embedding: Embedding the shapes were fitted on.
+        :param weights: Optional weight of each descriptor in the distance, by default all 1.
+        """
+        self.names = np.asarray(names, dtype=str)
+        self.descriptors = np.asarray(descriptors, dtype=float).reshape(len(self.names), len(DESCRIPTORS))
+        self.embedding = embedding
+        self.weights = np.ones(len(DESCRIPTORS)) if weights is None else np.asarray(weights, dtype=float)
+        self.positions = {name: position for position, name in enumerate(self.names.tolist())}
+        with np.errstate(invalid='ignore'):
+            self.center = np.nanmean(self.descriptors, axis=0) if len(self.names) else np.zeros(len(DESCRIPTORS))
+            self.scale = np.nanstd(self.descriptors, axis=0) if len(self.names) else np.ones(len(DESCRIPTORS))
+        self.center[np.isnan(self.center)] = 0
+        self.scale[~(self.scale > 0)] = 1
+        self.vectors = self.standardize(self.descriptors)
+        self.tree = cKDTree(self.vectors)
+
+    @classmethod
+    def from_networks(cls, names, embedding='kroneckerPoint', weights=None):
+        """
+        Building the index from the output directories of fitted networks, networks without shapes are left out.
+        :param names: Network names, i.e. their output directories.
+        :param embedding: Embedding whose shapes are indexed.
+        :return index: The ShapeIndex.
+        """
+        descriptors = np.array([describe(name, embedding) for name in names]).reshape(len(names), len(DESCRIPTORS))
+        fitted = ~np.isnan(descriptors).all(axis=1)
+        for name in np.asarray(names, dtype=str)[~fitted]:
+            print('{} has no {} shapes, left out of the index'.format(name, embedding))
+        return cls(np.asarray(names, dtype=str)[fitted], descriptors[fitted], embedding, weights)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['names'], data['descriptors'], str(data['embedding']), data['weights'])
+
+    def save(self, path):
+        # the tree is rebuilt on load, which takes milliseconds even for thousands of networks
+        np.savez(path, names=self.names, descriptors=self.descriptors, embedding=self.embedding,
+                 weights=self.weights)
+
+    def standardize(self, descriptors):
+        vectors = (np.atleast_2d(descriptors) - self.center) / self.scale * self.weights
+        # a missing descriptor counts as the dataset average
+        vectors[np.isnan(vectors)] = 0
+        return vectors
+
+    def descriptor(self, name):
+        return self.descriptors[self.positions[name]]
+
+    def query(self, queries, k=5):
+        """
+        The method finds the networks with the most similar shapes.
+        :param queries: A network name, a list of them, or an array of descriptors of shape (queries, len(DESCRIPTORS)).
+        :param k: Number of neighbors.
+        :return neighbors: For each query, a list of (name, distance), nearest first. A network in the
+                           index is not returned as its own neighbor.
+        """
+        single = isinstance(queries, str)
+        if single:
+            queries = [queries]
+        by_name = len(queries) > 0 and isinstance(queries[0], str)
+        if by_name:
+            own = [self.positions[name] for name in queries]
+            vectors = self.vectors[own]
+        else:
+            vectors = self.standardize(queries) if len(queries) else np.zeros((0, len(DESCRIPTORS)))
+            own = [-1] * len(vectors)
+        # one more neighbor for a network of the index, which finds itself
+        count = min(k + by_name, len(self.names))
+        neighbors = [[] for _ in own]
+        if count > 0 and len(vectors):
+            distances, indices = self.tree.query(vectors, k=count)
+            distances, indices = distances.reshape(len(vectors), count), indices.reshape(len(vectors), count)
+            neighbors = [[(str(self.names[index]), float(distance))
+                          for distance, index in zip(row_distances, row_indices) if index != position][:k]
+                         for position, row_distances, row_indices in zip(own, distances, indices)]
+        return neighbors[0] if single else neighbors
+
+    def pairwise(self, names=None):
+        """
+        The method computes the distances between networks.
+        :param names: Networks to compare, by default all of them.
+        :return distances: Array of shape (networks, networks).
+        """
+        vectors = self.vectors if names is None else self.vectors[[self.positions[name] for name in names]]
+        squared = (vectors ** 2).sum(axis=1)
+        distances = squared[:, None] + squared[None, :] - 2 * vectors @ vectors.T
+        return np.sqrt(np.maximum(distances, 0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find networks with similar shapes.")
+
+    parser.add_argument("-index", default="shape_index.npz",
+                        help="Path of the index.")
+
+    parser.add_argument("-build", nargs="*", default=None,
+                        help="Build the index from these network directories.")
+
+    parser.add_argument("-manifest", default=None,
+                        help="Build the index from the networks of a batch manifest.")
+
+    parser.add_argument("-embedding", default="kroneckerPoint", choices=sorted(POINTS_FILES),
+                        help="Embedding whose shapes are indexed.")
+
+    parser.add_argument("-query", nargs="*", default=[],
+                        help="Networks to find neighbors of.")
+
+    parser.add_argument("-k", type=int, default=5,
+                        help="Number of neighbors.")
+
+    args = parser.parse_args()
+    if args.build is not None or args.manifest is not None:
+        names = list(args.build or [])
+        if args.manifest is not None:
+            with open(args.manifest) as f:
+                names += [entry['name'] for entry in json.load(f)]
+        index = ShapeIndex.from_networks(names, args.embedding)
+        index.save(args.index)
+        print("Indexed {} networks in {}".format(len(index.names), args.index))
+    else:
+        index = ShapeIndex.load(args.index)
+    for name, neighbors in zip(args.query, index.query(args.query, args.k) if args.query else []):
+        print("{}: {}".format(name, ", ".join("{} ({:.3f})".format(n, d) for n, d in neighbors)))
@@ -0,0 +1,150 @@
+import os
+import numpy as np
+from Graph import mix64, file_hash
+from Sampler import sample_counts
+from scheduler import load_manifest
+import tracing
+import stamps
+
+
+class StreamSampler:
+    """
+    Out-of-core sampler reading the edge list in chunks, for graphs that do not fit in memory.
+    All (p, i) samples are drawn in a single pass over the file: membership of an edge (randomEdge)
+    or of a node (randomNode) is a Bernoulli test on a 64-bit hash of its ids, the seed and (p, i),
+    so memory stays bounded by the chunk size no matter how large the input is.
+    Node ids must be integers.
+    """
+    def __init__(self, args):
+        self.args = args
+        self.network_name = args.name
+        self.edgelist = args.file
+        self.step = int(args.step)
+        self.nos = int(args.t)
+        self.sampling_method = args.sampling
+        self.embedding_method = args.embedding
+        self.directory = self.network_name + '/'
+        self.chunk_size = int(args.chunk_size)
+        self.nested = args.nested
+        # without a seed the samples are random, but one base is shared by the whole pass
+        self.seed = args.seed if args.seed is not None else int(np.random.SeedSequence().entropy % 2 ** 63)
+        if self.sampling_method not in ('randomEdge', 'randomNode'):
+            raise ValueError('{} sampling needs the whole graph in memory, run without -streaming'.format(
+                self.sampling_method))
+
+    def sample(self):
+        content_hash = file_hash(self.edgelist)
+        # the streamed samples are int64 in file order, they never stand in for those of the Sampler
+        keys = {(100, 0): stamps.key('stream_graph', content_hash)}
+        counts = sample_counts(self.args)
+        for p in counts:
+            for i in range(0, counts[p]):
+                keys[p, i] = stamps.key('stream_sample', content_hash, self.sampling_method, self.args.seed,
+                                        self.nested, p, i)
+        paths = {(p, i): self.directory + str(p) + '/' + str(i) + '.npy' for (p, i) in keys}
+        paths[100, 0] = self.directory + '100.npy'
+        updates_path = self.directory + 'updates.json'
+        updates = load_manifest(updates_path)
+        self.apply_update_keys(keys, paths, updates)
+        for p in counts:
+            if not os.path.isdir(self.directory + str(p) + '/'):
+                os.mkdir(self.directory + str(p) + '/')
+        stale = [(p, i) for (p, i) in keys if not stamps.is_fresh(paths[p, i], keys[p, i])]
+        if updates and stale:
+            # a sample drawn from -file alone would miss the changes of update.py the other samples have
+            if len(stale) < len(keys):
+                raise ValueError('{} of the samples of {} would be redrawn from {} without the {} deltas applied '
+                                 'by update.py, see {}. Remove it to redraw all samples from {}.'.format(
+                                     len(stale), self.network_name, self.edgelist, len(updates), updates_path,
+                                     self.edgelist))
+            print('Redrawing all samples from {}, the changes of update.py are dropped'.format(self.edgelist))
+            os.remove(updates_path)
+        writers = {(p, i): NpyAppender(paths[p, i]) for (p, i) in stale}
+        print('Sampling {} subgraphs in one pass'.format(len(writers) - ((100, 0) in writers)))
+        if not writers:
+            return
+
+        for edges in self.read_chunks():
+            with tracing.span('stream_chunk', edges=len(edges), samples=len(writers)):
+                for (p, i), writer in writers.items():
+                    if p == 100:
+                        writer.append(edges)
+                    else:
+                        writer.append(edges[self.sample_mask(edges, p, i)])
+        for (p, i), writer in writers.items():
+            with tracing.span('write_sample', p=p, i=i, edges=writer.count):
+                stamps.invalidate(writer.npy_path)
+                writer.close()
+                stamps.write(writer.npy_path, keys[p, i])
+
+    def apply_update_keys(self, keys, paths, updates):
+        """
+        The method changes the keys of the samples update.py rewrote into the keys it stamped them with,
+        so the updated samples are up to date instead of being redrawn from the unchanged edge list.
+        :param keys: Dictionary (p, i) -> stamp key of the sample drawn from the edge list.
+        :param paths: Dictionary (p, i) -> sample file.
+        :param updates: The updates.json of the network, delta hash -> applied update.
+        """
+        samples = {path: sample for sample, path in paths.items()}
+        for delta_hash, update in sorted(updates.items(), key=lambda item: item[1].get('order', 0)):
+            for path in update.get('files', []):
+                if path in samples:
+                    keys[samples[path]] = stamps.key('update_sample', keys[samples[path]], delta_hash)
+
+    def read_chunks(self):
+        import pandas as pd
+        reader = pd.read_csv(self.edgelist, sep='\t', comment='#', header=None, usecols=[0, 1],
+                             dtype=np.int64, chunksize=self.chunk_size)
+        for chunk in reader:
+            # undirected (min, max) pairs, duplicates are merged when a sample is loaded as a Graph
+            yield np.sort(chunk.values, axis=1)
+
+    def sample_key(self, p, i):
+        if self.nested:
+            # one key per replicate, an edge or node kept at p is kept at every larger proportion
+            p = 0
+        return mix64(mix64(mix64(np.uint64(self.seed)) + np.uint64(p)) + np.uint64(i))
+
+    def sample_mask(self, edges, p, i):
+        key = self.sample_key(p, i)
+        if self.sampling_method == 'randomEdge':
+            return uniform(mix64(mix64(edges[:, 0].astype(np.uint64) ^ key) + edges[:, 1].astype(np.uint64))) \
+                < p / 100.0
+        else:
+            node_in = lambda nodes: uniform(mix64(nodes.astype(np.uint64) ^ key)) < p / 100.0
+            return node_in(edges[:, 0]) & node_in(edges[:, 1])
+
+
+def uniform(hashes):
+    """
+    Function to map uint64 hashes to floats uniform in [0, 1).
+    """
+    return (hashes >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+
+class NpyAppender:
+    """
+    Writing an (m, 2) int64 .npy file whose length is only known at the end, with bounded memory.
+    """
+    def __init__(self, npy_path):
+        self.npy_path = npy_path
+        self.raw_path = npy_path[:-len('.npy')] + '.tmp.raw'
+        open(self.raw_path, 'wb').close()
+        self.count = 0
+
+    def append(self, edges):
+        # reopened per chunk, hundreds of samples must not hold hundreds of open files
+        with open(self.raw_path, 'ab') as raw:
+            raw.write(np.ascontiguousarray(edges, dtype='<i8').tobytes())
+        self.count += len(edges)
+
+    def close(self, chunk_size=1 << 24):
+        tmp_path = self.npy_path[:-len('.npy')] + '.tmp.npy'
+        with open(tmp_path, 'wb') as output_file, open(self.raw_path, 'rb') as raw:
+            np.lib.format.write_array_header_1_0(
+                output_file, {'descr': '<i8', 'fortran_order': False, 'shape': (self.count, 2)})
+            for data in iter(lambda: raw.read(chunk_size), b''):
+                output_file.write(data)
+        os.remove(self.raw_path)
+        # renamed last, like the in-memory Sampler, so an existing sample file is always complete
+        os.replace(tmp_path, self.npy_path)
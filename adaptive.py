@@ -0,0 +1,117 @@
+import copy
+import json
+import numpy as np
+from scipy.spatial import QhullError
+from scipy.spatial.distance import cdist
+import geometry
+from Embedder import Embedder
+from wlsvd import run_wlsvd, load_basis, count_matrix, project
+
+
+def proportion_hull(xyz):
+    """
+    Function to fit the hull of the points of one proportion.
+    :return hull: (volume, vertices), None if the points do not span a volume yet.
+    """
+    if len(xyz) < 4:
+        return None
+    try:
+        vertices, volume, area = geometry.convex_hull(xyz)
+    except QhullError:
+        return None
+    return volume, vertices
+
+
+def hull_change(previous, current):
+    """
+    Function to measure how much a hull moved between two rounds.
+    :param previous: (volume, vertices) of the previous round.
+    :param current: (volume, vertices) of this round.
+    :return change: The larger of the relative volume change and of the largest vertex displacement
+                    (symmetric Hausdorff distance of the vertex sets) relative to the hull diameter.
+    """
+    volume_change = abs(current[0] - previous[0]) / max(previous[0], 1e-300)
+    distances = cdist(previous[1], current[1])
+    displacement = max(distances.min(axis=0).max(), distances.min(axis=1).max())
+    diameter = cdist(current[1], current[1]).max()
+    return max(volume_change, displacement / max(diameter, 1e-300))
+
+
+class KronRounds:
+    """
+    Kronecker points of the samples drawn so far, only the new samples are fitted in each round.
+    """
+    def __init__(self, args):
+        self.args = copy.copy(args)
+        self.args.embedding = 'kroneckerPoint'
+
+    def points(self, counts):
+        self.args.sample_counts = counts
+        return np.array(Embedder(self.args).embed())
+
+
+class WlsvdRounds:
+    """
+    wlsvd points of the samples drawn so far. The basis is fitted on the first round and later samples are
+    projected on it, so the hulls of all rounds are in the same coordinates and old samples are not hashed again.
+    """
+    def __init__(self, args):
+        self.args = copy.copy(args)
+        self.args.embedding = 'wlsvd'
+        self.directory = args.name + '/'
+        self.known = {}
+
+    def points(self, counts):
+        self.args.sample_counts = counts
+        files = [(self.directory + str(p) + '/' + str(i) + '.npy', p) for p in counts for i in range(counts[p])]
+        if not self.known:
+            # run_wlsvd lists the samples by proportion and index, then the full graph
+            for (x1, x2, x3, p), (path, q) in zip(run_wlsvd(self.args), files + [(self.directory + '100.npy', 100)]):
+                self.known[path] = [x1, x2, x3, q]
+            self.basis, self.n_features, self.wl_iterations = load_basis(self.directory + 'wlsvd_basis.npz')
+        new = [(path, p) for (path, p) in files if path not in self.known]
+        if new:
+            X = count_matrix([path for path, p in new], self.wl_iterations, self.n_features)
+            for (path, p), (x1, x2, x3) in zip(new, project(X, self.basis)):
+                self.known[path] = [x1, x2, x3, p]
+        return np.array([self.known[path] for path, p in files])
+
+
+def adaptive_sample(args, sampler):
+    """
+    Function to draw samples in rounds until the hull of each proportion has converged.
+    Every round adds -t samples to each proportion still changing, embeds only the new samples and refits
+    the hull of each proportion. A proportion stops once its hull changes by less than -adaptive-tol in a
+    round, or once it has -max-samples samples.
+    :param args: Object with the arguments.
+    :param sampler: The Sampler or StreamSampler of the network.
+    :return counts: Dictionary proportion -> number of samples, also set as args.sample_counts.
+    """
+    round_size = int(args.t)
+    budget = max(round_size, int(args.max_samples))
+    counts = {p: round_size for p in range(int(args.step), 100, int(args.step))}
+    rounds = KronRounds(args) if args.adaptive_embedding == 'kroneckerPoint' else WlsvdRounds(args)
+    hulls = {}
+    active = set(counts)
+    history = []
+    while active:
+        args.sample_counts = dict(counts)
+        sampler.sample()
+        points = rounds.points(dict(counts))
+        changes = {}
+        for p in sorted(active):
+            hull = proportion_hull(points[points[:, 3] == p, :3])
+            if hull is not None and hulls.get(p) is not None:
+                changes[p] = hull_change(hulls[p], hull)
+            hulls[p] = hull
+            if changes.get(p, np.inf) < args.adaptive_tol or counts[p] >= budget:
+                active.discard(p)
+            else:
+                counts[p] = min(budget, counts[p] + round_size)
+        history.append({'counts': dict(args.sample_counts), 'changes': changes})
+        print('Adaptive round {}: {} of {} proportions still changing'.format(len(history), len(active), len(counts)))
+
+    args.sample_counts = counts
+    with open(args.name + '/adaptive.json', 'w') as f:
+        json.dump({'counts': counts, 'rounds': history}, f, indent=2)
+    return counts
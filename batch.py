@@ -0,0 +1,233 @@
+'''
+Batch mode of Network Shapes: builds the shapes of many networks in one process.
+The modules are imported once, joblib's worker pool is reused by every network, the KronFit jobs of all
+networks are scheduled together longest-first and the MATLAB backend starts a single engine.
+
+    python batch.py -manifest networks.json [network_shapes options shared by all networks]
+
+The manifest is a JSON list of networks, each with a name and a file and optionally any other
+network_shapes option for that network only, e.g.
+    [{"name": "as20graph", "file": "as20graph.txt"}, {"name": "ca-GrQc", "file": "ca-GrQc.txt", "t": 10}]
+'''
+
+import os
+import sys
+import copy
+import json
+import traceback
+import numpy as np
+from network_shapes import build_parser, run_stage
+from Sampler import Sampler
+from StreamSampler import StreamSampler
+from Embedder import Embedder
+from Fitter import Fitter, read_shape, start_matlab
+from scheduler import schedule
+from render import render_all
+from adaptive import adaptive_sample
+import tracing
+
+
+def read_manifest(manifest_path, args):
+    """
+    Function to read the networks of a batch.
+    :param manifest_path: Path to the JSON manifest.
+    :param args: The options shared by all networks.
+    :return networks: List of argument objects, one per network.
+    """
+    with open(manifest_path) as f:
+        entries = json.load(f)
+    networks = []
+    for entry in entries:
+        if 'name' not in entry or 'file' not in entry:
+            raise ValueError('Every network of {} needs a name and a file: {}'.format(manifest_path, entry))
+        network_args = copy.copy(args)
+        for option, value in entry.items():
+            option = option.lstrip('-').replace('-', '_')
+            if not hasattr(args, option):
+                raise ValueError('Unknown option {} for network {}'.format(option, entry['name']))
+            setattr(network_args, option, value)
+        networks.append(network_args)
+    names = [network_args.name for network_args in networks]
+    if len(set(names)) != len(names):
+        raise ValueError('Network names of {} are not unique'.format(manifest_path))
+    return networks
+
+
+def batch_kronfit(job, timeout=None, memory_limit=None):
+    # a job of the shared schedule, the Embedder of its network does the fit within the limits of that network
+    embedder, kronfit_job, timeout, memory_limit = job
+    return embedder.kronfit(kronfit_job, timeout, memory_limit)
+
+
+class Batch:
+    """
+    Running sampling, embedding and fitting stage by stage over all networks of a manifest.
+    A network that fails at a stage is left out of the later stages, the other networks go on.
+    """
+    def __init__(self, args, networks):
+        self.args = args
+        self.networks = networks
+        self.embeddings = [args.embedding] + ['kroneckerPoint'] * (args.embedding != 'kroneckerPoint')
+        # network name -> (stage, traceback) of the failed networks
+        self.failures = {}
+
+    def active(self):
+        return [network_args for network_args in self.networks if network_args.name not in self.failures]
+
+    def fail(self, network_args, stage, error):
+        print('{} failed at {}'.format(network_args.name, stage))
+        self.failures[network_args.name] = (stage, error)
+        with open(network_args.name + '/batch_error.log', 'w') as f:
+            f.write('{}\n{}'.format(stage, error))
+
+    def run(self):
+        for network_args in self.networks:
+            if not os.path.isdir(network_args.name):
+                os.mkdir(network_args.name)
+        for network_args in self.active():
+            print("Sampling {}".format(network_args.name))
+            try:
+                sampler = StreamSampler(network_args) if network_args.streaming else Sampler(network_args)
+                if network_args.adaptive:
+                    # sets network_args.sample_counts, which the later stages of the network follow
+                    run_stage(network_args, 'sample', adaptive_sample, network_args, sampler)
+                else:
+                    run_stage(network_args, 'sample', sampler.sample)
+            except Exception:
+                self.fail(network_args, 'sample', traceback.format_exc())
+
+        fitters = []
+        eng = None
+        try:
+            for embedding in self.embeddings:
+                embedding_args = {}
+                for network_args in self.active():
+                    embedding_args[network_args.name] = copy.copy(network_args)
+                    embedding_args[network_args.name].embedding = embedding
+                if embedding == 'kroneckerPoint':
+                    self.run_kronfit([Embedder(embedding_args[network_args.name]) for network_args in self.active()])
+                for network_args in self.active():
+                    network_args = embedding_args[network_args.name]
+                    print("Embedding {} with {}".format(network_args.name, embedding))
+                    try:
+                        points = run_stage(network_args, 'embed', Embedder(network_args).embed)
+                        if network_args.fitting_backend == 'matlab' and eng is None:
+                            eng = start_matlab()
+                        fitter = Fitter(network_args)
+                        run_stage(network_args, 'fit', fitter.fit, points, eng)
+                        fitters.append((network_args, fitter))
+                    except Exception:
+                        self.fail(network_args, embedding, traceback.format_exc())
+        finally:
+            if eng is not None:
+                eng.quit()
+
+        # the plots of all networks in one parallel pass, the MATLAB scripts draw their own
+        fitters = [(network_args, fitter) for network_args, fitter in fitters if network_args.name not in self.failures]
+        for error in render_all([(network_args.name, fitter.embedding_method) for network_args, fitter in fitters
+                                 if not network_args.no_render and network_args.fitting_backend != 'matlab']):
+            print('Rendering failed: {}'.format(error))
+        for network_args, fitter in fitters:
+            fitter.zip_shapes()
+
+    def run_kronfit(self, embedders):
+        """
+        The method runs the KronFit jobs of all networks in one longest-first schedule, so the largest
+        graphs of the batch start first and small networks fill the gaps. The Embedder of each network
+        then finds its fits up to date and only collects the points.
+        """
+        # the full graphs of the warm-started networks first, their sample fits start from the initiators
+        warm = [(embedder, embedder.full_kronfit_job()) for embedder in embedders if embedder.kronfit_warm_start]
+        if warm:
+            self.schedule_kronfit(warm)
+        jobs = []
+        for embedder in embedders:
+            if embedder.network_name in self.failures:
+                continue
+            # a network whose jobs cannot be built fails here, not the whole schedule
+            try:
+                full_jobs = [] if embedder.kronfit_warm_start else [embedder.full_kronfit_job()]
+                jobs += [(embedder, job) for job in full_jobs + embedder.sample_kronfit_jobs()]
+            except Exception:
+                self.fail(embedder.args, 'kroneckerPoint', traceback.format_exc())
+        self.schedule_kronfit(jobs)
+
+    def schedule_kronfit(self, jobs):
+        sizes = []
+        for embedder, job in jobs:
+            # a network whose samples cannot be read fails here, not the whole schedule
+            try:
+                sizes.append(np.load(job[0], mmap_mode='r').shape[0])
+            except Exception:
+                sizes.append(None)
+                if embedder.network_name not in self.failures:
+                    self.fail(embedder.args, 'kroneckerPoint', traceback.format_exc())
+        jobs = [(embedder, job) for (embedder, job), size in zip(jobs, sizes) if size is not None]
+        sizes = [size for size in sizes if size is not None]
+        # each network may set its own limits, they go with its jobs instead of to the whole schedule
+        failed = schedule(batch_kronfit,
+                          [(embedder, job, embedder.kronfit_timeout, embedder.kronfit_memory)
+                           for embedder, job in jobs],
+                          keys=[job[2] for embedder, job in jobs],
+                          sizes=sizes,
+                          manifest_path=self.args.name + '_kronfit_manifest.json',
+                          output_keys=[embedder.kronfit_key(job) for embedder, job in jobs])
+        for embedder, job in jobs:
+            if job[2] in failed and embedder.network_name not in self.failures:
+                self.fail(embedder.args, 'kroneckerPoint', failed[job[2]]['stderr'])
+
+    def write_summary(self, summary_path):
+        """
+        The method writes one row per network with the parameters of its fitted shapes.
+        """
+        columns = ['name', 'status', 'failed_stage']
+        for embedding in self.embeddings:
+            columns += [embedding + '_' + column for column in
+                        ['hull_volume', 'hull_area', 'box_edge_1', 'box_edge_2', 'box_edge_3', 'box_volume',
+                         'sphere_radius']]
+        with open(summary_path, 'w') as f:
+            f.write(','.join(columns) + '\n')
+            for network_args in self.networks:
+                stage = self.failures.get(network_args.name, ('', ''))[0]
+                row = [network_args.name, 'failed' if stage else 'ok', stage]
+                for embedding in self.embeddings:
+                    shape = read_shape(network_args.name + '/' + embedding + '/')
+                    row += [shape['hull_volume'], shape['hull_area']] + list(shape['box_edges']) \
+                        + [shape['box_volume'], shape['sphere_radius']]
+                f.write(','.join('{}'.format(value) for value in row) + '\n')
+
+
+def build_batch_parser():
+    parser = build_parser()
+    parser.description = 'Generating the 3D Network Shapes of many networks'
+
+    parser.add_argument('-manifest', required=True,
+                        help='JSON list of networks, each with a name, a file and optionally its own options')
+
+    parser.add_argument('-summary', required=False,
+                        default=None,
+                        help='CSV table of the shape parameters of every network, defaults to <manifest>_summary.csv')
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_batch_parser().parse_args()
+    # -name names the batch, its KronFit manifest and trace are <name>_kronfit_manifest.json and <name>_trace/
+    args.name = os.path.splitext(args.manifest)[0]
+    networks = read_manifest(args.manifest, args)
+    if args.trace:
+        tracing.enable(args.name + '_trace/')
+
+    batch = Batch(args, networks)
+    batch.run()
+    summary_path = args.summary or args.name + '_summary.csv'
+    batch.write_summary(summary_path)
+    print('{} of {} networks done, shape parameters written to {}'.format(
+        len(networks) - len(batch.failures), len(networks), summary_path))
+
+    if args.trace:
+        tracing.write_chrome_trace(args.name + '_trace/', args.name + '_trace.json')
+    if batch.failures:
+        for name, (stage, error) in sorted(batch.failures.items()):
+            print('{} failed at {}: {}'.format(name, stage, error.strip().splitlines()[-1]))
+        sys.exit(1)
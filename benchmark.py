@@ -0,0 +1,516 @@
+'''
+Benchmark of the Network Shapes pipeline on synthetic graphs.
+Every stage runs in a fresh process and reports its wall time, CPU time and peak RSS as JSON:
+
+    python benchmark.py -edges 10000 100000 -output before.json
+    python benchmark.py -edges 10000 100000 -output after.json -compare before.json
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import argparse
+import subprocess
+import traceback
+import multiprocessing
+import numpy as np
+from Graph import Graph, canonical_edges, write_edgelist
+from kronfit import INITIATOR
+import stamps
+
+GENERATORS = ['kronecker', 'barabasi', 'erdos']
+STAGES = ['load_parse', 'load_cold', 'load_warm',
+          'sample_randomEdge', 'sample_randomNode', 'sample_randomWalk',
+          'write_npy', 'write_edgelist',
+          'wl_features', 'wlsvd_features', 'doc2vec', 'kronfit', 'fitter']
+
+
+def kronecker_graph(edges, rng, initiator=INITIATOR):
+    """
+    Function to generate a stochastic Kronecker graph by dropping edges into the initiator quadrants.
+    :param edges: Number of edges to drop, duplicates and self loops are removed afterwards.
+    :param rng: The numpy random Generator.
+    :param initiator: Initiator [a, b, c, d].
+    :return edges: Canonical edges.
+    """
+    # about 8 edges per node, as in the social and technological networks the method is used on
+    levels = max(1, int(round(np.log2(max(edges / 8.0, 2)))))
+    u = np.zeros(edges, dtype=np.int64)
+    v = np.zeros(edges, dtype=np.int64)
+    probabilities = np.asarray(initiator, dtype=float) / np.sum(initiator)
+    for _ in range(levels):
+        quadrant = rng.choice(4, size=edges, p=probabilities)
+        u = u << 1 | quadrant >> 1
+        v = v << 1 | quadrant & 1
+    return canonical_edges(np.stack([u, v], axis=1)[u != v])
+
+
+def barabasi_albert_graph(edges, rng, k=4):
+    """
+    Function to generate a Barabasi-Albert graph, each new node attaching k edges by preferential attachment.
+    An edge end point is a uniform pick among the end points of all earlier edges, which is resolved
+    for all edges at once by pointer jumping instead of growing the graph node by node.
+    :param edges: Number of edges.
+    :param rng: The numpy random Generator.
+    :param k: Edges of each new node.
+    :return edges: Canonical edges.
+    """
+    n = max(k + 2, edges // k + k)
+    src = np.repeat(np.arange(k, n, dtype=np.int64), k)
+    count = len(src)
+    dst = np.full(count, -1, dtype=np.int64)
+    dst[:k] = np.arange(k)
+    # end point slot 2e is src[e] and 2e + 1 is dst[e], a node only picks among slots of earlier nodes
+    block_start = np.arange(count) // k * k
+    slot = (rng.random(count) * 2 * block_start).astype(np.int64)
+    pointer = slot // 2
+    from_src = slot % 2 == 0
+    from_src[:k] = False
+    dst[from_src] = src[pointer[from_src]]
+    unresolved = np.flatnonzero(dst < 0)
+    while len(unresolved):
+        target = pointer[unresolved]
+        done = dst[target] >= 0
+        dst[unresolved[done]] = dst[target[done]]
+        pointer[unresolved[~done]] = pointer[target[~done]]
+        unresolved = unresolved[~done]
+    return canonical_edges(np.stack([src, dst], axis=1))
+
+
+def erdos_renyi_graph(edges, rng):
+    """
+    Function to generate an Erdos-Renyi G(n, m) graph with an average degree of 8.
+    :param edges: Number of edges drawn, duplicates and self loops are removed afterwards.
+    :param rng: The numpy random Generator.
+    :return edges: Canonical edges.
+    """
+    n = max(2, edges // 4)
+    pairs = rng.integers(n, size=(edges, 2))
+    return canonical_edges(pairs[pairs[:, 0] != pairs[:, 1]])
+
+
+def generate(generator, edges, seed):
+    rng = np.random.default_rng([seed, GENERATORS.index(generator), edges])
+    if generator == 'kronecker':
+        return kronecker_graph(edges, rng)
+    elif generator == 'barabasi':
+        return barabasi_albert_graph(edges, rng)
+    elif generator == 'erdos':
+        return erdos_renyi_graph(edges, rng)
+    raise ValueError('Unknown generator {}'.format(generator))
+
+
+class Workspace:
+    """
+    Inputs shared by the stages of one synthetic graph: the edge list, its cache and a few samples.
+    """
+    def __init__(self, directory, step, t, seed, kronfit_iterations, points):
+        self.directory = directory
+        self.name = os.path.join(directory, 'network')
+        self.file = os.path.join(directory, 'network.txt')
+        self.cache_dir = self.name + '/cache/'
+        self.step = step
+        self.t = t
+        self.seed = seed
+        self.kronfit_iterations = kronfit_iterations
+        self.points = points
+
+    def args(self, *options):
+        """
+        The method builds the arguments of a network_shapes run on this workspace.
+        """
+        from network_shapes import build_parser
+        return build_parser().parse_args(['-name', self.name, '-file', self.file, '-step', str(self.step),
+                                          '-t', str(self.t), '-seed', str(self.seed)] + list(options))
+
+    def samples(self):
+        return [self.name + '/' + str(p) + '/' + str(i) + '.npy'
+                for p in range(self.step, 100, self.step) for i in range(self.t)]
+
+    def prepare(self, edges):
+        """
+        The method writes the edge list, builds its cache and draws the samples the later stages read.
+        """
+        from Sampler import Sampler
+        write_edgelist(self.file, edges)
+        os.makedirs(self.name)
+        Sampler(self.args()).sample()
+
+
+# each stage gets the workspace, does its untimed setup and returns the timed part,
+# which returns the number of items (edges, graphs or points) it processed
+
+def stage_load_parse(workspace):
+    return lambda: Graph.read_edgelist(workspace.file).m
+
+
+def stage_load_cold(workspace):
+    cache_dir = os.path.join(workspace.directory, 'cold_cache/')
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    return lambda: Graph.load(workspace.file, cache_dir).m
+
+
+def stage_load_warm(workspace):
+    def run():
+        graph = Graph.load(workspace.file, workspace.cache_dir)
+        # touch the mapped arrays, an mmap alone reads nothing
+        graph.edges.sum()
+        graph.indices.sum()
+        return graph.m
+    return run
+
+
+def sampling_stage(method):
+    def stage(workspace):
+        from Sampler import Sampler
+
+        class CountingSampler(Sampler):
+            # keeps the samples in memory, writing is measured by its own stages
+            def write(self, edges, directory, p, i):
+                self.sampled += len(edges)
+
+        sampler = CountingSampler(workspace.args('-sampling', method))
+        sampler.sampled = 0
+
+        def run():
+            for p in range(workspace.step, 100, workspace.step):
+                sampler.sample_job(p, 0)
+            return sampler.sampled
+        return run
+    return stage
+
+
+def stage_write_npy(workspace):
+    from Sampler import Sampler
+    sampler = Sampler(workspace.args())
+    edges = np.load(workspace.name + '/100.npy')
+    output = os.path.join(workspace.directory, 'write.npy')
+
+    def run():
+        sampler.write_npy(output, edges)
+        return len(edges)
+    return run
+
+
+def stage_write_edgelist(workspace):
+    edges = np.load(workspace.name + '/100.npy')
+    output = os.path.join(workspace.directory, 'write.edgelist')
+
+    def run():
+        write_edgelist(output, edges)
+        return len(edges)
+    return run
+
+
+def stage_wl_features(workspace):
+    from graph2vec import WeisfeilerLehmanMachine, dataset_reader
+    files = workspace.samples()
+
+    def run():
+        for path in files:
+            graph, features, name = dataset_reader(path)
+            WeisfeilerLehmanMachine(graph, features, 2)
+        return len(files)
+    return run
+
+
+def stage_wlsvd_features(workspace):
+    from wlsvd import count_matrix
+    files = workspace.samples()
+    return lambda: count_matrix(files, 2, 2 ** 18).shape[0]
+
+
+def stage_doc2vec(workspace):
+    from graph2vec import feature_extractor, train_model
+    documents = [feature_extractor(path, 2, str(index) + "_") for index, path in enumerate(workspace.samples())]
+
+    def run():
+        # the settings of run_graph2vec
+        train_model(documents, 3, 4, 10, 5, 0.025, 0.0001)
+        return len(documents)
+    return run
+
+
+def stage_kronfit(workspace):
+    from kronfit import fit_initiator
+    edges = np.load(workspace.name + '/100.npy')
+
+    def run():
+        fit_initiator(edges, np.random.default_rng(workspace.seed), iterations=workspace.kronfit_iterations)
+        return len(edges)
+    return run
+
+
+def stage_fitter(workspace):
+    from Fitter import Fitter
+    rng = np.random.default_rng(workspace.seed)
+    points = np.column_stack([rng.random((workspace.points, 3)), rng.integers(1, 101, workspace.points)])
+    fitter = Fitter(workspace.args('-fitting-backend', 'python'))
+    # fitted shapes of the same points are reused, the stage must fit every time
+    stamps.invalidate(fitter.directory)
+
+    def run():
+        fitter.fit(points.tolist())
+        return len(points)
+    return run
+
+
+def stage_function(stage):
+    if stage.startswith('sample_'):
+        return sampling_stage(stage[len('sample_'):])
+    return globals()['stage_' + stage]
+
+
+def rss():
+    # resident set size in bytes right now, ru_maxrss only gives the peak
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def reset_peak_rss():
+    # Linux can restart the peak at the current RSS, the peak then excludes the stage setup
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def measure(stage, workspace, connection):
+    """
+    Function running one stage in a child process and sending its measurements back.
+    Reusable joblib workers are shut down before the final reading, so their CPU time is counted.
+    """
+    try:
+        run = stage_function(stage)(workspace)
+        peak_reset = reset_peak_rss()
+        start_rss = rss()
+        start_self = resource.getrusage(resource.RUSAGE_SELF)
+        start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.perf_counter()
+        items = run()
+        wall = time.perf_counter() - start
+        try:
+            from joblib.externals.loky import get_reusable_executor
+            get_reusable_executor().shutdown(wait=True)
+        except ImportError:
+            pass
+        end_self = resource.getrusage(resource.RUSAGE_SELF)
+        end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        unit = 1 if sys.platform == 'darwin' else 1024
+        connection.send({
+            'wall': wall,
+            'cpu': (end_self.ru_utime + end_self.ru_stime) - (start_self.ru_utime + start_self.ru_stime),
+            'cpu_children': (end_children.ru_utime + end_children.ru_stime)
+                            - (start_children.ru_utime + start_children.ru_stime),
+            'peak_rss': peak_rss(),
+            'peak_rss_includes_setup': not peak_reset,
+            'peak_rss_children': end_children.ru_maxrss * unit,
+            'start_rss': start_rss,
+            'items': None if items is None else int(items),
+        })
+    except Exception:
+        connection.send({'error': traceback.format_exc()[-4000:]})
+    finally:
+        connection.close()
+
+
+def run_stage(stage, workspace, timeout):
+    """
+    Function to run a stage in a fresh process, so its peak RSS is not the peak of an earlier stage.
+    :return record: The measurements, or an error.
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=measure, args=(stage, workspace, sender))
+    process.start()
+    sender.close()
+    if receiver.poll(timeout):
+        try:
+            record = receiver.recv()
+        except EOFError:
+            record = None
+    else:
+        record = {'error': 'timeout after {} seconds'.format(timeout)}
+        process.terminate()
+    process.join()
+    if record is None:
+        record = {'error': 'stage process exited with code {}'.format(process.exitcode)}
+    return record
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+    except OSError:
+        commit = ''
+    return {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count(),
+        'arguments': vars(args),
+    }
+
+
+def run_benchmark(args):
+    """
+    Main function to generate the graphs and measure each stage on each of them.
+    :param args: Object with the arguments.
+    :return results: List of stage records.
+    """
+    results = []
+    for generator in args.generators:
+        for target in args.edges:
+            directory = tempfile.mkdtemp(prefix='network_shapes_benchmark_', dir=args.workdir)
+            try:
+                start = time.perf_counter()
+                edges = generate(generator, target, args.seed)
+                generation = time.perf_counter() - start
+                workspace = Workspace(directory, args.step, args.t, args.seed, args.kronfit_iterations,
+                                      args.points)
+                workspace.prepare(edges)
+                nodes = len(np.unique(edges))
+                print('{} graph: {} nodes, {} edges, generated in {:.2f}s'.format(
+                    generator, nodes, len(edges), generation))
+                for stage in args.stages:
+                    for repeat in range(args.repeat):
+                        record = {'generator': generator, 'target_edges': target, 'nodes': nodes,
+                                  'edges': len(edges), 'stage': stage, 'repeat': repeat}
+                        record.update(run_stage(stage, workspace, args.timeout))
+                        results.append(record)
+                        if 'error' in record:
+                            print('  {:<20} failed: {}'.format(stage, record['error'].strip().splitlines()[-1]))
+                        else:
+                            print('  {:<20} {:9.3f}s wall {:9.3f}s cpu {:9.1f} MB peak'.format(
+                                stage, record['wall'], record['cpu'] + record['cpu_children'],
+                                max(record['peak_rss'], record['peak_rss_children']) / 2 ** 20))
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def best(results):
+    # fastest repeat of each (generator, size, stage), the least disturbed by other load on the machine
+    runs = {}
+    for record in results:
+        if 'error' in record:
+            continue
+        key = (record['generator'], record['target_edges'], record['stage'])
+        if key not in runs or record['wall'] < runs[key]['wall']:
+            runs[key] = record
+    return runs
+
+
+def compare(results, baseline, threshold, min_seconds):
+    """
+    Function to find stages that got slower or bigger than in a baseline run.
+    :param results: The new stage records.
+    :param baseline: The stage records of the baseline.
+    :param threshold: Relative increase reported as a regression, e.g. 0.2 for 20%.
+    :param min_seconds: Stages faster than this in both runs are too noisy to compare times.
+    :return regressions: List of (generator, edges, stage, metric, old, new).
+    """
+    new, old = best(results), best(baseline)
+    regressions = []
+    for key in sorted(set(new) & set(old), key=str):
+        for metric in ['wall', 'peak_rss']:
+            before, after = old[key][metric], new[key][metric]
+            if metric == 'wall' and max(before, after) < min_seconds:
+                continue
+            if after > before * (1 + threshold):
+                regressions.append(key + (metric, before, after))
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the Network Shapes pipeline on synthetic graphs')
+
+    parser.add_argument('-edges', nargs='+', type=int, default=[10000, 100000],
+                        help='Edge counts of the generated graphs, e.g. 10000 up to 10000000')
+
+    parser.add_argument('-generators', nargs='+', default=GENERATORS, choices=GENERATORS,
+                        help='Stochastic Kronecker, Barabasi-Albert and Erdos-Renyi graphs')
+
+    parser.add_argument('-stages', nargs='+', default=STAGES, choices=STAGES,
+                        help='Stages to measure')
+
+    parser.add_argument('-step', type=int, default=20,
+                        help='Sampling proportion step of the sampling stages')
+
+    parser.add_argument('-t', type=int, default=2,
+                        help='Samples per proportion read by the WL, wlsvd and Doc2Vec stages')
+
+    parser.add_argument('-kronfit-iterations', type=int, default=10,
+                        help='Gradient iterations of the KronFit stage')
+
+    parser.add_argument('-points', type=int, default=1000,
+                        help='Number of embedded points given to the Fitter stage')
+
+    parser.add_argument('-repeat', type=int, default=1,
+                        help='Runs of each stage, comparisons use the fastest')
+
+    parser.add_argument('-timeout', type=float, default=3600,
+                        help='Wall-clock limit of one stage in seconds')
+
+    parser.add_argument('-seed', type=int, default=0,
+                        help='Seed of the generated graphs and of the pipeline')
+
+    parser.add_argument('-workdir', default=None,
+                        help='Directory for the temporary files, defaults to the system temp directory')
+
+    parser.add_argument('-output', default='benchmark.json',
+                        help='JSON file with the measurements')
+
+    parser.add_argument('-compare', default=None,
+                        help='JSON file of an earlier run to check for regressions')
+
+    parser.add_argument('-threshold', type=float, default=0.2,
+                        help='Relative slowdown or memory growth reported as a regression')
+
+    parser.add_argument('-min-seconds', type=float, default=0.1,
+                        help='Stages faster than this are not compared on time')
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    results = run_benchmark(args)
+    with open(args.output, 'w') as f:
+        json.dump({'metadata': metadata(args), 'results': results}, f, indent=2)
+    print('Results written to {}'.format(args.output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold, args.min_seconds)
+        for generator, edges, stage, metric, before, after in regressions:
+            print('Regression: {} {} edges {} {}: {:.4g} -> {:.4g}'.format(
+                generator, edges, stage, metric, before, after))
+        if regressions:
+            sys.exit(1)
+        print('No regressions against {}'.format(args.compare))
@@ -0,0 +1,160 @@
+import numpy as np
+from scipy.spatial import ConvexHull
+
+
+def convex_hull(xyz):
+    """
+    Function to compute the convex hull of a 3D point set.
+    :param xyz: Array of points with shape (n, 3).
+    :return vertices: Unique hull vertices, sorted by rows (as in get_convex_hull.m).
+    :return volume: Volume enclosed by the hull.
+    :return area: Surface area of the hull.
+    """
+    xyz = np.asarray(xyz, dtype=float)
+    hull = ConvexHull(xyz)
+    vertices = np.unique(xyz[hull.vertices], axis=0)
+    return vertices, hull.volume, hull.area
+
+
+def sphere_fit(xyz):
+    """
+    Function to compute the enclosing sphere around the centroid (as in sphereFit.m).
+    :param xyz: Array of points with shape (n, 3).
+    :return center: Centroid of the points.
+    :return radius: Largest distance from the centroid to a point.
+    """
+    xyz = np.asarray(xyz, dtype=float)
+    center = xyz.mean(axis=0)
+    radius = np.sqrt(((xyz - center) ** 2).sum(axis=1)).max()
+    return center, radius
+
+
+def min_bound_box(xyz, metric='v', level=3):
+    """
+    Function to compute the minimal bounding box of a 3D point set (port of minboundbox.m).
+    :param xyz: Array of points with shape (n, 3).
+    :param metric: Quantity to minimize, 'v' (volume), 's' (surface) or 'e' (sum of edges).
+    :param level: 1 checks boxes with a side on a hull face, 3 also checks boxes with an edge
+                  parallel to a hull edge.
+    :return rotmat: Rotation matrix mapping the points into an axis-parallel box.
+    :return cornerpoints: The 8 corner points of the box.
+    :return volume: Volume of the box.
+    :return surface: Surface of the box.
+    :return edgelength: Sum of the edge lengths of the box.
+    """
+    if level not in (1, 3):
+        raise ValueError('level must be either 1 or 3')
+    xyz = np.asarray(xyz, dtype=float)
+    hull = ConvexHull(xyz)
+    # points inside the hull are never needed
+    xyz = xyz[hull.vertices]
+    simplices = np.searchsorted(hull.vertices, hull.simplices)
+    frames = face_frames(xyz, simplices)
+    if level == 3:
+        frames = np.concatenate([frames, edge_frames(xyz, simplices)])
+
+    d = np.inf
+    rotmat = None
+    minmax = None
+    for frame in frames:
+        # the third axis of the frame is fixed, find the best rotation around it
+        xyz_i = xyz @ frame
+        rot = frame.copy()
+        rot[:, :2] = frame[:, :2] @ min_rect(xyz_i[:, :2], metric)
+        xyz_i = xyz @ rot
+        xyzmin = xyz_i.min(axis=0)
+        xyzmax = xyz_i.max(axis=0)
+        h = xyzmax - xyzmin
+        if metric == 'v':
+            d_i = h[0] * h[1] * h[2]
+        elif metric == 's':
+            d_i = h[0] * h[1] + h[1] * h[2] + h[2] * h[0]
+        else:
+            d_i = h.sum()
+        if d_i < d:
+            d = d_i
+            rotmat = rot
+            minmax = np.vstack([xyzmin, xyzmax])
+
+    lo, hi = minmax
+    corners = np.array([[lo[0], lo[1], lo[2]],
+                        [hi[0], lo[1], lo[2]],
+                        [hi[0], hi[1], lo[2]],
+                        [lo[0], hi[1], lo[2]],
+                        [lo[0], lo[1], hi[2]],
+                        [hi[0], lo[1], hi[2]],
+                        [hi[0], hi[1], hi[2]],
+                        [lo[0], hi[1], hi[2]]])
+    cornerpoints = corners @ rotmat.T
+    h = hi - lo
+    volume = h[0] * h[1] * h[2]
+    surface = 2 * (h[0] * h[1] + h[1] * h[2] + h[2] * h[0])
+    edgelength = 4 * h.sum()
+    return rotmat, cornerpoints, volume, surface, edgelength
+
+
+def face_frames(xyz, simplices):
+    """
+    Function to build one orthonormal frame per hull face, with the face normal as third axis.
+    :param xyz: Hull points.
+    :param simplices: Hull faces as rows of point indices.
+    :return frames: Array of shape (faces, 3, 3), axes as columns.
+    """
+    p1 = xyz[simplices[:, 0]]
+    v1 = normalize(xyz[simplices[:, 1]] - p1)
+    v2 = xyz[simplices[:, 2]] - p1
+    v2 = normalize(v2 - (v1 * v2).sum(axis=1, keepdims=True) * v1)
+    nv = np.cross(v1, v2)
+    return np.stack([v1, v2, nv], axis=2)
+
+
+def edge_frames(xyz, simplices):
+    """
+    Function to build the frames having a hull edge as one of their axes.
+    :param xyz: Hull points.
+    :param simplices: Hull faces as rows of point indices.
+    :return frames: Array of shape (3 * edges, 3, 3), axes as columns.
+    """
+    edges = np.concatenate([simplices[:, [0, 1]], simplices[:, [1, 2]], simplices[:, [0, 2]]])
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    va = xyz[edges[:, 0]] - xyz[edges[:, 1]]
+    vb = np.stack([va[:, 1], -va[:, 0], np.zeros(len(va))], axis=1)
+    vertical = np.abs(vb).sum(axis=1) == 0
+    vb[vertical] = np.stack([va[vertical, 2], np.zeros(vertical.sum()), -va[vertical, 0]], axis=1)
+    va = normalize(va)
+    vb = normalize(vb)
+    nv = np.cross(va, vb)
+    # check all combinations of possible right-handed systems
+    return np.concatenate([np.stack([va, vb, nv], axis=2),
+                           np.stack([vb, nv, va], axis=2),
+                           np.stack([nv, va, vb], axis=2)])
+
+
+def min_rect(xy, metric):
+    """
+    Function to find the rotation of the minimal bounding rectangle of 2D points.
+    :param xy: Array of points with shape (n, 2).
+    :param metric: 'v' minimizes the area, anything else the perimeter.
+    :return rot: 2x2 rotation matrix.
+    """
+    try:
+        hull = ConvexHull(xy)
+        ring = xy[hull.vertices]
+    except Exception:
+        # projected points are collinear, any rotation gives a degenerate rectangle
+        return np.eye(2)
+    d = np.roll(ring, -1, axis=0) - ring
+    angles = np.unique(np.mod(np.arctan2(d[:, 1], d[:, 0]), np.pi / 2))
+    theta = -angles
+    cos, sin = np.cos(theta), np.sin(theta)
+    x = np.outer(cos, ring[:, 0]) - np.outer(sin, ring[:, 1])
+    y = np.outer(sin, ring[:, 0]) + np.outer(cos, ring[:, 1])
+    w = x.max(axis=1) - x.min(axis=1)
+    h = y.max(axis=1) - y.min(axis=1)
+    met = w * h if metric == 'v' else 2 * (w + h)
+    best = np.argmin(met)
+    return np.array([[cos[best], sin[best]], [-sin[best], cos[best]]])
+
+
+def normalize(v):
+    return v / np.sqrt((v ** 2).sum(axis=1, keepdims=True))
@@ -1,13 +1,11 @@
-import json
-import glob
-import hashlib
 import logging
-import pandas as pd
-import networkx as nx
+import numpy as np
+from Graph import Graph, mix64
+from Sampler import sample_counts
+import tracing
+import stamps
 from tqdm import tqdm
 from joblib import Parallel, delayed
-import numpy.distutils.system_info as sysinfo
-from gensim.models.doc2vec import Doc2Vec, TaggedDocument
 import argparse
 import os
 
@@ -15,36 +13,39 @@ logging.basicConfig(format="%(asctime)s : %(levelname)s : %(message)s", level=lo
 
 class WeisfeilerLehmanMachine:
     """
-    Weisfeiler Lehman feature extractor class.
+    Weisfeiler Lehman feature extractor class working on CSR neighbor arrays.
+    Labels are 64-bit hashes of the node label and the multiset of its neighbor labels, so the same
+    structure gets the same token in every graph and process without sharing a label dictionary.
     """
     def __init__(self, graph, features, iterations):
         """
         Initialization method which also executes feature extraction.
-        :param graph: The Nx graph object.
-        :param features: Feature hash table.
+        :param graph: The Graph object.
+        :param features: Array of initial node features.
         :param iterations: Number of WL iterations.
         """
         self.iterations = iterations
         self.graph = graph
-        self.features = features
-        self.nodes = self.graph.nodes()
-        self.extracted_features = [str(v) for k,v in features.items()]
+        self.features = np.asarray(features).astype(np.uint64)
+        self.labels = [self.features]
+        self.extracted_features = [str(v) for v in np.asarray(features).tolist()]
         self.do_recursions()
 
-    def do_a_recursion(self):
+    def do_a_recursion(self, iteration):
         """
         The method does a single WL recursion.
-        :return new_features: The hash table with extracted WL features.
+        :param iteration: Index of the recursion, part of the hash so levels never share labels.
+        :return new_features: The array with extracted WL labels.
         """
-        new_features = {}
-        for node in self.nodes:
-            nebs = self.graph.neighbors(node)
-            degs = [self.features[neb] for neb in nebs]
-            features = "_".join([str(self.features[node])]+sorted([str(deg) for deg in degs]))
-            hash_object = hashlib.md5(features.encode())
-            hashing = hash_object.hexdigest()
-            new_features[node] = hashing
-        self.extracted_features = self.extracted_features + list(new_features.values())
+        # the neighbor multiset is hashed as a wrapping sum of mixed labels, which needs no sorting
+        mixed = mix64(self.features ^ NEIGHBOR_SALT)[self.graph.indices]
+        sums = np.zeros(self.graph.n, dtype=np.uint64)
+        nonempty = np.diff(self.graph.indptr) > 0
+        if mixed.size:
+            sums[nonempty] = np.add.reduceat(mixed, self.graph.indptr[:-1][nonempty])
+        new_features = mix64(mix64(self.features + np.uint64(iteration)) + sums)
+        self.labels.append(new_features)
+        self.extracted_features = self.extracted_features + [format(v, '016x') for v in new_features.tolist()]
         return new_features
 
     def do_recursions(self):
@@ -52,63 +53,86 @@ class WeisfeilerLehmanMachine:
         The method does a series of WL recursions.
         """
         for iteration in range(self.iterations):
-            self.features = self.do_a_recursion()
-        
-def dataset_reader(path):
+            self.features = self.do_a_recursion(iteration)
+
+
+NEIGHBOR_SALT = np.uint64(0x5851F42D4C957F2D)
+
+def dataset_reader(path, edges=None):
     """
-    Function to read the graph and features from a json file.
-    :param path: The path to the graph json.
+    Function to read the graph and features from a sample .npy edge array.
+    :param path: The path to the graph .npy.
+    :param edges: The edges of the graph if they are already in memory, then the file is not read.
     :return graph: The graph object.
-    :return features: Features hash table.
+    :return features: Node degrees.
     :return name: Name of the graph.
     """
-    name = path.strip(".json").split("/")[-1]
-    data = json.load(open(path))
-    graph = nx.from_edgelist(data["edges"])
-
-    if "features" in data.keys():
-        features = data["features"]
-        features = {int(k):v for k,v, in features.items()}
-    else:
-        features = nx.degree(graph)
-        features = {int(k):v for k,v, in list(features)}
+    name = os.path.splitext(os.path.basename(path))[0]
+    graph = Graph.from_edges(np.load(path, mmap_mode='r') if edges is None else edges)
+    features = graph.degree()
     return graph, features, name
 
-def feature_extractor(path, rounds):
+def feature_extractor(path, rounds, prefix=""):
     """
     Function to extract WL features from a graph.
-    :param path: The path to the graph json.
+    :param path: The path to the graph .npy.
     :param rounds: Number of WL iterations.
+    :param prefix: Prefix of the document tag, keeps tags unique when documents of several proportions share a model.
     :return doc: Document collection object.
     """
-    graph, features, name = dataset_reader(path)
-    machine = WeisfeilerLehmanMachine(graph,features,rounds)
-    doc = TaggedDocument(words = machine.extracted_features , tags = ["g_" + name])
+    with tracing.span('wl_features', graph=path) as span:
+        graph, features, name = dataset_reader(path)
+        span.update(nodes=graph.n, edges=graph.m)
+        machine = WeisfeilerLehmanMachine(graph,features,rounds)
+    # gensim and pandas are only imported by graph2vec runs, wlsvd shares the WL code without them
+    from gensim.models.doc2vec import TaggedDocument
+    doc = TaggedDocument(words = machine.extracted_features , tags = ["g_" + prefix + name])
     return doc
         
-def save_embedding(output_path, model, files, dimensions):
+def save_embedding(output_path, model, files, dimensions, prefix=""):
     """
     Function to save the embedding.
     :param output_path: Path to the embedding csv.
     :param model: The embedding model object.
     :param files: The list of files.
     :param dimensions: The embedding dimension parameter.
+    :param prefix: Prefix of the document tags used by feature_extractor.
     """
+    import pandas as pd
     out = []
     for f in files:
-        identifier = f.split("/")[-1].strip(".json")
-        out.append([int(identifier)] + list(model.docvecs["g_"+identifier]))
+        identifier = os.path.splitext(os.path.basename(f))[0]
+        out.append([int(identifier)] + list(model.docvecs["g_" + prefix + identifier]))
 
     # print(out)
     out = pd.DataFrame(out,columns = ["type"] +["x_" +str(dimension) for dimension in range(dimensions)])
     out = out.sort_values(["type"])
     out.to_csv(output_path, index = None)
 
+def train_model(document_collections, dimensions, workers, epochs, min_count, learning_rate, down_sampling):
+    """
+    Function to train the Doc2Vec (PV-DBOW) model on WL documents.
+    :param document_collections: The list of TaggedDocument.
+    :return model: The trained model.
+    """
+    from gensim.models.doc2vec import Doc2Vec
+    with tracing.span('doc2vec', documents=len(document_collections)):
+        return Doc2Vec(document_collections,
+                       size = dimensions,
+                       window = 0,
+                       min_count = min_count,
+                       dm = 0,
+                       sample = down_sampling,
+                       workers = workers,
+                       iter = epochs,
+                       alpha = learning_rate)
+
 def run_graph2vec(args):
     """
     Main function to read the graph list, extract features, learn the embedding and save it.
     :param args: Object with the arguments.
     """
+    import pandas as pd
     directory = args.name + '/'
 
     dimensions = 3
@@ -119,50 +143,56 @@ def run_graph2vec(args):
     learning_rate = 0.025
     down_sampling = 0.0001
 
-    step = int(args.step)
-    for p in range(step, 100, step):
-        # print(p)
-        graphs = glob.glob(directory + '/' + str(p) + "/*.json")
-        output_path = directory + '/' + str(p) + "/g2v.csv"
+    n_jobs = max(1, int(len(os.sched_getaffinity(0)) / 2))
+    counts = sample_counts(args)
+    sample_graphs = {p: [directory + '/' + str(p) + '/' + str(i) + '.npy' for i in range(counts[p])] for p in counts}
+    full_graphs = [directory + "/100.npy"]
+
+    output_path = directory + "/g2v_points.txt"
+    output_key = stamps.key('graph2vec', args.g2v_model, dimensions, workers, epochs, min_count, wl_iterations,
+                            learning_rate, down_sampling,
+                            [(g, stamps.read(g)) for p in sorted(sample_graphs) for g in sorted(sample_graphs[p])],
+                            stamps.read(full_graphs[0]))
+    if stamps.is_fresh(output_path, output_key):
+        print("\ngraph2vec points are up to date.\n")
+        return read_points(output_path)
+    stamps.invalidate(output_path)
+
+    def train(document_collections):
+        return train_model(document_collections, dimensions, workers, epochs, min_count, learning_rate,
+                           down_sampling)
+
+    if args.g2v_model == 'single':
+        # one extraction pass and one model for all proportions, so all points share a coordinate system
+        jobs = [(g, str(p) + "_") for p in sample_graphs for g in sample_graphs[p]] + [(g, "") for g in full_graphs]
         print("\nFeature extraction started.\n")
-        document_collections = Parallel(n_jobs=int((len(os.sched_getaffinity(0)) / 2)))(delayed(feature_extractor)(g, wl_iterations) for g in tqdm(graphs))
+        document_collections = Parallel(n_jobs=n_jobs)(delayed(feature_extractor)(g, wl_iterations, prefix) for (g, prefix) in tqdm(jobs))
         print("\nOptimization started.\n")
+        model = train(document_collections)
+        for p in sample_graphs:
+            save_embedding(directory + '/' + str(p) + "/g2v.csv", model, sample_graphs[p], dimensions, str(p) + "_")
+        save_embedding(directory + "/g2v.csv", model, full_graphs, dimensions)
+    else:
+        for p in sample_graphs:
+            graphs = sample_graphs[p]
+            csv_path = directory + '/' + str(p) + "/g2v.csv"
+            print("\nFeature extraction started.\n")
+            document_collections = Parallel(n_jobs=n_jobs)(delayed(feature_extractor)(g, wl_iterations) for g in tqdm(graphs))
+            print("\nOptimization started.\n")
+            model = train(document_collections)
+            save_embedding(csv_path, model, graphs, dimensions)
 
-        model = Doc2Vec(document_collections,
-                        size = dimensions,
-                        window = 0,
-                        min_count = min_count,
-                        dm = 0,
-                        sample = down_sampling,
-                        workers = workers,
-                        iter = epochs,
-                        alpha = learning_rate)
-
-        save_embedding(output_path, model, graphs, dimensions)
-
-    graphs = glob.glob(directory + "/*.json")
-    output_path = directory + "/g2v.csv"
-    print("\nFeature extraction started.\n")
-    document_collections = Parallel(n_jobs=int((len(os.sched_getaffinity(0)) / 2)))(
-        delayed(feature_extractor)(g, wl_iterations) for g in tqdm(graphs))
-    print("\nOptimization started.\n")
-
-    model = Doc2Vec(document_collections,
-                    size=3,
-                    window=0,
-                    min_count=min_count,
-                    dm=0,
-                    sample=down_sampling,
-                    workers=workers,
-                    iter=epochs,
-                    alpha=learning_rate)
-    save_embedding(output_path, model, graphs, dimensions)
+        print("\nFeature extraction started.\n")
+        document_collections = Parallel(n_jobs=n_jobs)(
+            delayed(feature_extractor)(g, wl_iterations) for g in tqdm(full_graphs))
+        print("\nOptimization started.\n")
+        model = train(document_collections)
+        save_embedding(directory + "/g2v.csv", model, full_graphs, dimensions)
 
-    output_path = directory + "/g2v_points.txt"
     points = []
     f = open(output_path, 'w')
     f.write('x1,x2,x3,sampling_proportion\n')
-    for p in range(step, 100, step):
+    for p in counts:
         data = pd.read_csv(directory + '/' + str(p) + "/g2v.csv")
         (row_num, col_num) = data.shape
         for i in range(0, row_num):
@@ -172,8 +202,17 @@ def run_graph2vec(args):
     f.write('{},{},{},{}\n'.format(str(data.ix[0, 'x_0']), str(data.ix[0, 'x_1']), str(data.ix[0, 'x_2']), str(100)))
     points.append([float(data.ix[0, 'x_0']), float(data.ix[0, 'x_1']), float(data.ix[0, 'x_2']), float(100)])
     f.close()
+    stamps.write(output_path, output_key)
     return points
 
+def read_points(path):
+    """
+    Function to read the points of a points file written by an embedding.
+    :param path: Path to a file with the header x1,x2,x3,sampling_proportion.
+    :return points: List of [x1, x2, x3, sampling_proportion].
+    """
+    return np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2).tolist()
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run Graph2Vec.")
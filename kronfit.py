@@ -0,0 +1,196 @@
+import math
+import time
+import numpy as np
+from Graph import Graph, directed_edges
+
+# initiator the kronfit binary starts from, [a, b; c, d]
+INITIATOR = [0.9, 0.7, 0.5, 0.2]
+
+
+class KroneckerFitter:
+    """
+    Fitting a 2x2 stochastic Kronecker initiator to a graph (KronFit, Leskovec et al.).
+    The log-likelihood uses the Taylor approximation of the empty-graph term and is averaged
+    over node permutations drawn by Metropolis sampling, all over NumPy edge arrays.
+    """
+    def __init__(self, edges, rng, init=INITIATOR):
+        """
+        :param edges: Array of shape (m, 2) of an undirected graph, fitted as its directed version.
+        :param rng: The numpy random Generator.
+        :param init: Initial initiator [a, b, c, d].
+        """
+        graph = Graph.from_edges(edges)
+        directed = directed_edges(graph.edges).astype(np.int64)
+        self.src = directed[:, 0]
+        self.dst = directed[:, 1]
+        self.n = graph.n
+        self.k = max(1, int(math.ceil(math.log2(max(graph.n, 2)))))
+        # nodes n..2^k-1 are the isolated padding nodes of the Kronecker graph
+        self.size = 2 ** self.k
+        self.mask = np.int64(self.size - 1)
+        self.rng = rng
+        self.theta = np.array(init, dtype=float)
+        degree = np.bincount(self.src, minlength=self.size)
+        self.pos = self.degree_permutation(degree)
+
+    def degree_permutation(self, degree):
+        """
+        The method puts high degree nodes on the positions with the highest expected degree.
+        :param degree: Degree of each node, padding included.
+        :return pos: Position of each node.
+        """
+        ones = count_ones(np.arange(self.size, dtype=np.int64))
+        a, b, c, d = self.theta
+        slots = np.argsort(ones if a + b >= c + d else -ones, kind='stable')
+        pos = np.empty(self.size, dtype=np.int64)
+        pos[np.argsort(-degree, kind='stable')] = slots
+        return pos
+
+    def level_counts(self, pu, pv):
+        """
+        The method counts, for each edge, the Kronecker levels using each initiator entry.
+        :return counts: Array of shape (4, m) for entries a, b, c, d.
+        """
+        c11 = count_ones(pu & pv)
+        c10 = count_ones(pu & ~pv & self.mask)
+        c01 = count_ones(~pu & pv & self.mask)
+        return np.stack([self.k - c11 - c10 - c01, c01, c10, c11])
+
+    def edge_likelihood(self, pu, pv, log_theta):
+        """
+        The method computes log P(u, v) - log(1 - P(u, v)) of edges, with log(1 - x) ~ -x - x^2 / 2.
+        """
+        log_p = log_theta @ self.level_counts(pu, pv)
+        p = np.exp(log_p)
+        return log_p + p + 0.5 * p * p
+
+    def log_likelihood(self):
+        """
+        The method computes the approximate log-likelihood of the graph under the current permutation.
+        """
+        log_theta = np.log(self.theta)
+        empty = -self.theta.sum() ** self.k - 0.5 * (self.theta ** 2).sum() ** self.k
+        return empty + self.edge_likelihood(self.pos[self.src], self.pos[self.dst], log_theta).sum()
+
+    def gradient(self):
+        """
+        The method computes the gradient of the log-likelihood for the current permutation.
+        """
+        counts = self.level_counts(self.pos[self.src], self.pos[self.dst])
+        p = np.exp(np.log(self.theta) @ counts)
+        edge_gradient = (counts * (1 + p + p * p)).sum(axis=1) / self.theta
+        empty_gradient = -self.k * self.theta.sum() ** (self.k - 1) \
+            - self.k * (self.theta ** 2).sum() ** (self.k - 1) * self.theta
+        return edge_gradient + empty_gradient
+
+    def metropolis_sweep(self):
+        """
+        The method proposes swapping the positions of random node pairs, all pairs at once.
+        Each swap is accepted on its own likelihood change, pairs sharing an edge are treated as independent.
+        """
+        log_theta = np.log(self.theta)
+        perm = self.rng.permutation(self.size)
+        first, second = perm[0::2], perm[1::2]
+        partner = np.arange(self.size)
+        partner[first] = second
+        partner[second] = first
+        pair = np.empty(self.size, dtype=np.int64)
+        pair[first] = np.arange(len(first))
+        pair[second] = np.arange(len(first))
+        new_pos = self.pos[partner]
+
+        pu, pv = self.pos[self.src], self.pos[self.dst]
+        new_pu, new_pv = new_pos[self.src], new_pos[self.dst]
+        old = self.edge_likelihood(pu, pv, log_theta)
+        same = pair[self.src] == pair[self.dst]
+        src_moved = np.where(same, self.edge_likelihood(new_pu, new_pv, log_theta),
+                             self.edge_likelihood(new_pu, pv, log_theta)) - old
+        dst_moved = np.where(same, 0, self.edge_likelihood(pu, new_pv, log_theta) - old)
+        delta = np.bincount(pair[self.src], weights=src_moved, minlength=len(first)) \
+            + np.bincount(pair[self.dst], weights=dst_moved, minlength=len(first))
+
+        accept = np.log(self.rng.random(len(first))) < delta
+        swap = np.concatenate([first[accept], second[accept]])
+        self.pos[swap] = new_pos[swap]
+
+    def fit(self, iterations=100, warmup=10, sweeps=5, learning_rate=1e-5, min_step=0.005, max_step=0.05,
+            tol=None, deadline=None):
+        """
+        The method runs the gradient ascent.
+        :param iterations: Maximal number of gradient iterations (-gi of kronfit).
+        :param warmup: Metropolis sweeps before the first gradient.
+        :param sweeps: Metropolis sweeps, and sampled gradients, per iteration.
+        :param learning_rate: Gradient step factor.
+        :param min_step: Smallest absolute update of an entry, as in kronfit, unless its bound is lower.
+        :param max_step: Largest absolute update of an entry, as in kronfit.
+        :param tol: Stop early once no entry moved by more than tol in an iteration.
+        :param deadline: Optional time.monotonic() value after which TimeoutError is raised.
+        :return theta: The fitted initiator [a, b, c, d].
+        """
+        for _ in range(warmup):
+            self.metropolis_sweep()
+        # step bound of each entry, halved when its gradient changes sign so the fit settles down
+        bound = np.full(4, float(max_step))
+        last_sign = np.zeros(4)
+        for _ in range(iterations):
+            gradient = np.zeros(4)
+            for _ in range(sweeps):
+                self.metropolis_sweep()
+                gradient += self.gradient()
+            sign = np.sign(gradient)
+            bound[sign * last_sign < 0] *= 0.5
+            last_sign = sign
+            step = np.clip(learning_rate * np.abs(gradient) / sweeps, np.minimum(min_step, bound), bound)
+            self.theta = np.clip(self.theta + sign * step, 1e-4, 0.9999)
+            if deadline is not None:
+                check_deadline(deadline)
+            if tol is not None and step.max() < tol:
+                break
+        return self.theta
+
+
+def check_deadline(deadline):
+    if time.monotonic() > deadline:
+        raise TimeoutError('kronfit did not finish within its time limit')
+
+
+def count_ones(x):
+    """
+    Function to count the set bits of non-negative int64 values.
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x).astype(np.int64)
+    x = x.astype(np.uint64)
+    with np.errstate(over='ignore'):
+        x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+        x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+        x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+        return ((x * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+
+def fit_initiator(edges, rng, iterations=100, init=INITIATOR, **kwargs):
+    """
+    Function to fit a Kronecker initiator to a sample.
+    :param edges: Array of shape (m, 2).
+    :param rng: The numpy random Generator.
+    :param iterations: Number of gradient iterations.
+    :param init: Initial initiator [a, b, c, d].
+    :return a, b, d: The fitted initiator entries used as a Kronecker point.
+    :return theta: The full fitted initiator.
+    :return log_likelihood: Approximate log-likelihood of the fit.
+    """
+    fitter = KroneckerFitter(edges, rng, init)
+    theta = fitter.fit(iterations, **kwargs)
+    return (theta[0], theta[1], theta[3]), theta, fitter.log_likelihood()
+
+
+def write_output(output_file, theta, edges, log_likelihood):
+    """
+    Function to write a fit in the layout of the kronfit output file read by Embedder.read_kron_point.
+    """
+    graph = Graph.from_edges(edges)
+    with open(output_file, 'w') as f:
+        f.write('Nodes\t{}\n'.format(graph.n))
+        f.write('Edges\t{}\n'.format(len(directed_edges(graph.edges))))
+        f.write('Log-likelihood\t{}\n'.format(log_likelihood))
+        f.write('Initiator\t[{}, {}; {}, {}]\n'.format(*theta))
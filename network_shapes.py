@@ -13,31 +13,21 @@ Versions: 1.0    The Original Version
           2.0    Added different sampling methods
           2.1    Added graph2vec as an embedding method
           2.2    Added fitting methods
+          2.3    Added a native fitting backend
 '''
 
-from sys import argv
-import random, os, shutil, time
-import uuid
-import math
-import subprocess
-import networkx as nx
-import re
-from scipy.spatial import ConvexHull
-import numpy as np
-import matplotlib
+import os
+import copy
 import argparse
+import registry
+import tracing
+# the stages import their modules when they run, a sampling-only run never loads scipy, gensim or matplotlib
 
-import matlab.engine
-from tqdm import tqdm
-from joblib import Parallel, delayed
-from Sampler import Sampler
-from Fitter import Fitter
-from Embedder import Embedder
+# the stages -profile can select, other scripts add their own, e.g. update.py its update stage
+PROFILE_STAGES = ['sample', 'pipeline', 'embed', 'fit', 'render']
 
 
-
-if __name__ == '__main__':
-
+def build_parser(profile_stages=PROFILE_STAGES):
     parser = argparse.ArgumentParser(
         description='Generating a 3D Network Shapes with a Kronecker Hull')
 
@@ -58,31 +48,218 @@ if __name__ == '__main__':
                         help='Number of samples for each sampling proporation"')
 
     parser.add_argument('-embedding', required=False,
-                        default='graph2vec',   # or kron
+                        default='graph2vec',   # or wlsvd, kron
+                        choices=registry.names('embedding'),
                         help='Embedding Methods')
 
+    parser.add_argument('-g2v-model', required=False,
+                        default='single',   # or per-step
+                        choices=['single', 'per-step'],
+                        help='Train one graph2vec model for all proportions or one model per proportion')
+
     parser.add_argument('-sampling', required=False,
                         default='randomEdge',
+                        choices=registry.names('sampling'),
                         help='Sampling Methods')
 
     parser.add_argument('-fitting', required=False,
                         default='convexhull',
                         help='Fitting Methods')
 
+    parser.add_argument('-kronfit-backend', required=False,
+                        default='native',   # or snap
+                        choices=['native', 'snap'],
+                        help='Fit Kronecker initiators in-process or with the SNAP kronfit binary')
+
+    parser.add_argument('-kronfit-timeout', required=False,
+                        default=None, type=float,
+                        help='Wall-clock limit of one Kronfit job in seconds')
+
+    parser.add_argument('-kronfit-memory', required=False,
+                        default=None, type=int,
+                        help='Memory limit of one Kronfit job in MB')
+
+    parser.add_argument('-kronfit-warm-start', required=False,
+                        help='Fit the full graph first and start every sample fit from its initiator',
+                        action='store_true')
+
+    parser.add_argument('-kronfit-tol', required=False,
+                        default=1e-3, type=float,
+                        help='Native warm-started fits stop once no initiator entry moves more than this')
+
+    parser.add_argument('-nested', required=False,
+                        help='Draw one random order per replicate, each proportion is a prefix of it',
+                        action='store_true')
+
+    parser.add_argument('-streaming', required=False,
+                        help='Sample in one pass over the edge list in chunks, for graphs that do not fit in memory',
+                        action='store_true')
+
+    parser.add_argument('-chunk-size', required=False,
+                        default=1000000, type=int,
+                        help='Edges read at a time with -streaming')
+
+    parser.add_argument('-adaptive', required=False,
+                        help='Add -t samples per proportion in rounds until its hull stops changing',
+                        action='store_true')
+
+    parser.add_argument('-adaptive-tol', required=False,
+                        default=0.05, type=float,
+                        help='A proportion has converged once its hull volume and vertices change less than this')
+
+    parser.add_argument('-adaptive-embedding', required=False,
+                        default='kroneckerPoint',
+                        choices=['kroneckerPoint', 'wlsvd'],
+                        help='Embedding whose hulls decide convergence with -adaptive')
+
+    parser.add_argument('-max-samples', required=False,
+                        default=20, type=int,
+                        help='Largest number of samples per proportion with -adaptive')
+
+    parser.add_argument('-pipeline', required=False,
+                        help='Fit every sample as soon as it is drawn, from its edges in memory, instead of '
+                             'sampling everything first',
+                        action='store_true')
+
+    parser.add_argument('-seed', required=False,
+                        default=None, type=int,
+                        help='Base random seed, each sample is seeded from it and its (proportion, index)')
+
+    parser.add_argument('-fitting-backend', required=False,
+                        default='python',   # or matlab
+                        choices=registry.names('fitting'),
+                        help='Fitting backend: native scipy/numpy geometry or the MATLAB engine')
+
+    parser.add_argument('-trace', required=False,
+                        help='Log the duration of every stage and job to <name>/trace.json (Chrome trace format)',
+                        action='store_true')
+
+    parser.add_argument('-profile', '--profile', required=False,
+                        default=None,
+                        choices=profile_stages,
+                        help='Run this stage under cProfile and save the statistics in <name>/profile_<stage>.prof')
+
+    parser.add_argument('-no-render', '--no-render', required=False,
+                        help='Compute the geometry only, without plotting the shapes of the native fitting backend',
+                        action='store_true')
+
+    parser.add_argument('-stop-after', required=False,
+                        default=None,
+                        choices=['sample', 'embed', 'fit'],
+                        help='Run the stages up to this one only, e.g. sample to only draw the samples')
+
     parser.add_argument('-z', '--zip', required=False,
                         help='Copy and Zip certain files to a new directory for downloading',
                         action='store_true')
+    return parser
 
 
-    args = parser.parse_args()
-    network_name = args.name
-    step = int(args.step)
-    nos = int(args.t)
-    embedding_method = args.embedding
-    sampling_method = args.sampling
-    fitting_method = args.fitting
+def run_stage(args, stage, func, *func_args):
+    """
+    Function to run one pipeline stage, traced and profiled if requested.
+    :param stage: 'sample', 'pipeline', 'embed', 'fit', 'render' or 'update'.
+    :return result: What func returns.
+    """
+    with tracing.span(stage, embedding=args.embedding):
+        if args.profile != stage:
+            return func(*func_args)
+        name = stage if stage in ('sample', 'pipeline', 'render', 'update') else stage + '_' + args.embedding
+        # only the main process is profiled, the spans of the workers are in the trace
+        return tracing.profiled(args.name + '/profile_' + name + '.prof', func, *func_args)
+
+
+def make_args(**options):
+    """
+    Function to build the arguments of a run in-process, without a command line.
+    Options are named as on the command line, e.g. make_args(name='ca-GrQc', file='ca-GrQc.txt', t=10,
+    kronfit_warm_start=True), the others keep their defaults.
+    :return args: The argparse Namespace.
+    """
+    args = build_parser().parse_args([])
+    for option, value in options.items():
+        option = option.lstrip('-').replace('-', '_')
+        if not hasattr(args, option):
+            raise ValueError('Unknown option {}'.format(option))
+        setattr(args, option, value)
+    return args
+
+
+def sample(args):
+    """
+    Function to draw the samples of a network.
+    :param args: Object with the arguments.
+    :return counts: Dictionary proportion -> number of samples.
+    """
+    from Sampler import sample_counts
+    if not os.path.isdir(args.name + '/'):
+        os.mkdir(args.name + '/')
+    if args.pipeline:
+        # samples and their kronecker points at once, the embedding stages find them up to date
+        from pipeline import run_pipeline
+        run_stage(args, 'pipeline', run_pipeline, args)
+        return sample_counts(args)
+    if args.streaming:
+        from StreamSampler import StreamSampler
+        sampler = StreamSampler(args)
+    else:
+        from Sampler import Sampler
+        sampler = Sampler(args)
+    if args.adaptive:
+        from adaptive import adaptive_sample
+        return run_stage(args, 'sample', adaptive_sample, args, sampler)
+    run_stage(args, 'sample', sampler.sample)
+    return sample_counts(args)
+
 
+def embed(args, embedding=None):
+    """
+    Function to embed the samples of a network.
+    :param args: Object with the arguments.
+    :param embedding: Embedding method, defaults to -embedding.
+    :return points: List of [x1, x2, x3, sampling_proportion].
+    """
+    from Embedder import Embedder
+    args = copy.copy(args)
+    args.embedding = embedding or args.embedding
+    return run_stage(args, 'embed', Embedder(args).embed)
 
+
+def fit(args, points, embedding=None, eng=None):
+    """
+    Function to fit the shapes of embedded points.
+    :param args: Object with the arguments.
+    :param points: List of [x1, x2, x3, sampling_proportion].
+    :param embedding: Embedding the points come from, defaults to -embedding.
+    :param eng: A running MATLAB engine to reuse with the matlab backend.
+    :return fitter: The Fitter, whose directory holds the shapes.
+    """
+    from Fitter import Fitter
+    args = copy.copy(args)
+    args.embedding = embedding or args.embedding
+    fitter = Fitter(args)
+    run_stage(args, 'fit', fitter.fit, points, eng)
+    return fitter
+
+
+def render(args, fitters):
+    """
+    Function to plot the fitted shapes, the MATLAB scripts draw their own figures.
+    :return errors: List of error messages of the plots that failed.
+    """
+    if args.no_render or args.fitting_backend == 'matlab':
+        return []
+    from render import render_all
+    return run_stage(args, 'render', render_all, [(args.name, fitter.embedding_method) for fitter in fitters])
+
+
+def run(args):
+    """
+    Function to run the stages of a network as the command line does: sampling, then embedding and fitting
+    with -embedding and with the Kronecker points, then rendering.
+    :param args: Object with the arguments, see build_parser or make_args.
+    :return fitters: The Fitters of the embeddings.
+    """
+    network_name = args.name
     directory = network_name + '/'
 #    if os.path.isdir(directory):
 #        shutil.rmtree(directory)
@@ -97,19 +274,31 @@ if __name__ == '__main__':
     print("Sampling Method: {}".format(args.sampling))
     # print("Fitting Method: {}".format(args.fitting))
 
+    if args.trace:
+        # before any worker pool starts, so the workers inherit it
+        tracing.enable(directory + 'trace/')
 
-    sampler = Sampler(args)
-    sampler.sample()
+    sample(args)
+    fitters = []
+    if args.stop_after != 'sample':
+        # Embedding with graph2vec, then with kron
+        for embedding in [args.embedding, 'kroneckerPoint']:
+            points = embed(args, embedding)
+            if args.stop_after != 'embed':
+                fitters.append(fit(args, points, embedding))
 
-    # Embedding with graph2vec
-    embedder = Embedder(args)
-    points = embedder.embed()
-    fitter = Fitter(args)
-    fitter.fit(points)
+    if args.stop_after is None:
+        for error in render(args, fitters):
+            print('Rendering failed: {}'.format(error))
+        for fitter in fitters:
+            fitter.zip_shapes()
 
-    # Embedding with kron
-    args.embedding = 'kroneckerPoint'
-    embedder = Embedder(args)
-    points = embedder.embed()
-    fitter = Fitter(args)
-    fitter.fit(points)
+    if args.trace:
+        tracing.write_chrome_trace(directory + 'trace/', directory + 'trace.json')
+        for name, count, total, longest in tracing.summary(directory + 'trace/'):
+            print('{:<16} {:>6} spans {:10.3f}s total {:10.3f}s longest'.format(name, count, total, longest))
+    return fitters
+
+
+if __name__ == '__main__':
+    run(build_parser().parse_args())
@@ -0,0 +1,137 @@
+import os
+from functools import partial
+import numpy as np
+from tqdm import tqdm
+from joblib import Parallel, delayed
+from Sampler import Sampler, sample_counts
+from Embedder import Embedder
+from scheduler import run_job, load_manifest, save_manifest
+from wlsvd import hashed_features, run_wlsvd, WL_ITERATIONS, N_FEATURES
+import stamps
+import tracing
+
+
+class HandoffSampler(Sampler):
+    """
+    Sampler handing every sample it writes to a consumer in the same process, so the next stages
+    use the edges in memory instead of reading the file back.
+    """
+    consumer = None
+
+    def write(self, edges, directory, p, i):
+        Sampler.write(self, edges, directory, p, i)
+        if self.consumer is not None:
+            self.consumer(p, i, edges)
+
+
+def pipeline_job(sampler, embedder, unit, wl, timeout=None, memory_limit=None):
+    """
+    Function to draw the samples of one unit and embed each of them as soon as it is drawn.
+    :param sampler: The HandoffSampler.
+    :param embedder: The Embedder running the KronFit jobs.
+    :param unit: List of (sample file, p, i, draw, kronfit job), one sample or one replicate with -nested.
+                 Samples with draw False are up to date and read from their file, only their fit is redone.
+    :param wl: Whether to count the hashed WL features of the drawn samples for wlsvd.
+    :return records: Dictionary kronfit output -> (run_job record, stamp key of the output).
+    :return rows: Dictionary sample file -> hashed_features of the drawn samples.
+    """
+    items = {(p, i): (path, draw, job) for (path, p, i, draw, job) in unit}
+    records = {}
+    rows = {}
+
+    def consume(p, i, edges):
+        path, draw, job = items[(p, i)]
+        if wl and draw:
+            rows[path] = hashed_features(path, WL_ITERATIONS, N_FEATURES, edges)
+        stamps.invalidate(job[2])
+        record = run_job(partial(embedder.kronfit, edges=edges), job, timeout, memory_limit)
+        record['size'] = int(len(edges))
+        # the key holds the stamp of the sample, which exists only now that it is drawn
+        records[job[2]] = (record, embedder.kronfit_key(job))
+
+    sampler.consumer = consume
+    drawn = [(p, i) for (path, p, i, draw, job) in unit if draw]
+    if drawn:
+        if sampler.nested:
+            sampler.nested_sample_job(drawn[0][1], [p for (p, i) in drawn])
+        else:
+            sampler.sample_job(*drawn[0])
+    for path, p, i, draw, job in unit:
+        if not draw:
+            consume(p, i, np.load(path, mmap_mode='r'))
+    return records, rows
+
+
+def run_pipeline(args, n_jobs=None):
+    """
+    Function to sample a network and fit its Kronecker points in one pass. Every worker draws a sample and
+    fits it right away with the edges still in memory, instead of all samples being written before the
+    first fit starts. The samples are dispatched largest first and at most two per worker are queued, so
+    only the samples being fitted are held in memory. The Embedder afterwards finds the fits up to date.
+    With -embedding wlsvd the WL features are counted from the same in-memory samples.
+    :param args: Object with the arguments.
+    :param n_jobs: Number of workers, defaults to all available cores.
+    """
+    if args.streaming or args.adaptive:
+        raise ValueError('-pipeline cannot be combined with -streaming or -adaptive')
+    sampler = HandoffSampler(args)
+    embedder = Embedder(args)
+    directory = args.name + '/'
+    manifest_path = directory + 'kronfit_manifest.json'
+    if n_jobs is None:
+        n_jobs = len(os.sched_getaffinity(0))
+
+    sampler.write_full()
+    if embedder.kronfit_warm_start:
+        # the sample fits start from the initiator of the full graph fit
+        embedder.run_kronfit([embedder.full_kronfit_job()])
+        init = embedder.full_initiator()
+    manifest = load_manifest(manifest_path)
+
+    def stale(job):
+        return not (stamps.is_fresh(job[2], embedder.kronfit_key(job))
+                    and manifest.get(job[2], {'status': 'ok'})['status'] == 'ok')
+
+    units = {}
+    if not embedder.kronfit_warm_start and stale(embedder.full_kronfit_job()):
+        units['full'] = [(directory + '100.npy', 100, 0, False, embedder.full_kronfit_job())]
+    counts = sample_counts(args)
+    for p in counts:
+        if not os.path.isdir(directory + str(p) + '/'):
+            os.mkdir(directory + str(p) + '/')
+        for i in range(counts[p]):
+            path = directory + str(p) + '/' + str(i) + '.npy'
+            job = (path, directory + str(p) + '/' + str(i) + '.edgelist',
+                   directory + str(p) + '/' + str(i) + '_output.dat',
+                   init if embedder.kronfit_warm_start else None)
+            draw = not stamps.is_fresh(path, sampler.sample_key(p, i))
+            if draw or stale(job):
+                # the proportions of a nested replicate are drawn together
+                units.setdefault(i if args.nested else (p, i), []).append((path, p, i, draw, job))
+    # largest samples first, so they do not start last and leave a long tail
+    units = sorted(units.values(), key=lambda unit: -sum(p for (path, p, i, draw, job) in unit))
+    print('Sampling and fitting {} units'.format(len(units)))
+
+    rows = {}
+    results = Parallel(n_jobs=n_jobs, batch_size=1, return_as='generator_unordered', pre_dispatch='2*n_jobs')(
+        delayed(pipeline_job)(sampler, embedder, unit, args.embedding == 'wlsvd', embedder.kronfit_timeout,
+                              embedder.kronfit_memory) for unit in units)
+    try:
+        for unit_records, unit_rows in tqdm(results, total=len(units)):
+            rows.update(unit_rows)
+            for key, (record, output_key) in unit_records.items():
+                manifest[key] = record
+                if record['status'] == 'ok':
+                    stamps.write(key, output_key)
+    finally:
+        # an interrupted run keeps the fits that finished
+        save_manifest(manifest_path, manifest)
+
+    outputs = [job[2] for unit in units for (path, p, i, draw, job) in unit]
+    failed = sorted(key for key in outputs if manifest[key]['status'] != 'ok')
+    if failed:
+        raise RuntimeError('Kronfit failed for {} graphs ({}), see {}. Rerun to retry them.'.format(
+            len(failed), ', '.join(failed), manifest_path))
+    if args.embedding == 'wlsvd':
+        with tracing.span('embed', embedding='wlsvd'):
+            run_wlsvd(args, known_rows=rows)
@@ -0,0 +1,69 @@
+'''
+Backends of the sampling, embedding and fitting stages, by the name selected with -sampling, -embedding
+and -fitting-backend. A backend is given as a callable or as 'module:attribute', in which case its module
+is only imported once the backend is used, so a run never pays for, or needs, the libraries of the
+backends it does not select.
+
+    sampling:  func(sampler, directory, p, i, rng=rng), draws sample i of proportion p with the numpy
+               Generator rng and hands its edges to sampler.write(edges, directory, p, i).
+    embedding: func(args), returns the points as a list of [x1, x2, x3, sampling_proportion].
+    fitting:   func(fitter, points, eng), writes the shapes of the points into fitter.directory, in the
+               files of the python backend (boundary.txt, corner_points.txt, center_radius.txt).
+
+Own backends are added with register, e.g. register('sampling', 'forestFire', 'my_samplers:forest_fire'),
+before the arguments are parsed or the stages are run.
+'''
+
+import importlib
+
+BACKENDS = {
+    'sampling': {
+        'randomEdge': 'Sampler:Sampler.random_edge_sampling',
+        'randomNode': 'Sampler:Sampler.random_node_sampling',
+        'randomWalk': 'Sampler:Sampler.random_walk_with_restart_sampling',
+    },
+    'embedding': {
+        'kroneckerPoint': 'Embedder:run_kronecker',
+        'graph2vec': 'graph2vec:run_graph2vec',
+        'wlsvd': 'wlsvd:run_wlsvd',
+    },
+    'fitting': {
+        'python': 'Fitter:Fitter.fit_native',
+        'matlab': 'Fitter:Fitter.fit_matlab',
+    },
+}
+
+
+def register(kind, name, backend):
+    """
+    Function to add a backend, or to replace one of the same name.
+    :param kind: 'sampling', 'embedding' or 'fitting'.
+    :param name: Name the backend is selected by.
+    :param backend: The callable, or 'module:attribute' to import it from when it is first used.
+    """
+    if kind not in BACKENDS:
+        raise ValueError('Unknown kind of backend {}, choose from {}'.format(kind, ', '.join(sorted(BACKENDS))))
+    BACKENDS[kind][name] = backend
+
+
+def names(kind):
+    return sorted(BACKENDS[kind])
+
+
+def load(kind, name):
+    """
+    Function to get a backend, importing its module the first time.
+    :param kind: 'sampling', 'embedding' or 'fitting'.
+    :param name: Name of the backend.
+    :return backend: The callable.
+    """
+    if name not in BACKENDS[kind]:
+        raise ValueError('Unknown {} method {}, choose from {}'.format(kind, name, ', '.join(names(kind))))
+    backend = BACKENDS[kind][name]
+    if isinstance(backend, str):
+        module_name, attribute = backend.split(':')
+        backend = importlib.import_module(module_name)
+        for part in attribute.split('.'):
+            backend = getattr(backend, part)
+        BACKENDS[kind][name] = backend
+    return backend
@@ -0,0 +1,91 @@
+import os
+import traceback
+import numpy as np
+from joblib import Parallel, delayed
+from scipy.spatial import ConvexHull, QhullError
+from ShapeIndex import read_points
+import stamps
+import tracing
+
+SHAPE_FILES = {'convexhull': 'boundary.txt', 'cuboid': 'corner_points.txt', 'sphere': 'center_radius.txt'}
+
+
+def shape_surface(shape, directory):
+    """
+    Function to build the surface of a fitted shape from its saved geometry.
+    :param shape: 'convexhull', 'cuboid' or 'sphere'.
+    :param directory: Output directory of a Fitter.
+    :return surface: ('triangles', vertices, simplices) or ('sphere', center, radius).
+    """
+    data = np.loadtxt(directory + SHAPE_FILES[shape], delimiter=',', ndmin=2)
+    if shape == 'sphere':
+        return 'sphere', data[0, :3], data[0, 3]
+    # boundary.txt and corner_points.txt only hold vertices, their hull gives the faces back
+    vertices = data[:, :3]
+    return 'triangles', vertices, ConvexHull(vertices).simplices
+
+
+def render_shape(shape, directory, points, display_name):
+    """
+    Function to draw a fitted shape and the embedded points into <directory>/<shape>.png, as the MATLAB scripts do.
+    Uses the Agg canvas directly, without pyplot or a display.
+    """
+    from matplotlib.figure import Figure
+    figure = Figure(figsize=(7, 6))
+    ax = figure.add_subplot(projection='3d')
+    surface = shape_surface(shape, directory)
+    if surface[0] == 'sphere':
+        center, radius = surface[1], surface[2]
+        u, v = np.meshgrid(np.linspace(0, 2 * np.pi, 40), np.linspace(0, np.pi, 20))
+        ax.plot_surface(center[0] + radius * np.cos(u) * np.sin(v), center[1] + radius * np.sin(u) * np.sin(v),
+                        center[2] + radius * np.cos(v), color='r', alpha=0.1)
+    else:
+        vertices, simplices = surface[1], surface[2]
+        ax.plot_trisurf(vertices[:, 0], vertices[:, 1], vertices[:, 2], triangles=simplices, color='r', alpha=0.1,
+                        edgecolor='k', linewidth=0.2)
+    scatter = ax.scatter(points[:, 0], points[:, 1], points[:, 2], s=12, c=points[:, 3])
+    ax.set_xlabel('a')
+    ax.set_ylabel('b')
+    ax.set_zlabel('d')
+    ax.set_title(display_name)
+    figure.colorbar(scatter, ax=ax, label='Sampling Proportion')
+    figure.savefig(directory + shape + '.png')
+
+
+def render_network(name, embedding):
+    """
+    Function to render the shapes of one network and embedding, skipping those rendered from the same fit.
+    :param name: Output directory of the network.
+    :param embedding: Embedding whose shapes are rendered.
+    :return errors: List of error messages of the shapes that could not be rendered.
+    """
+    directory = name + '/' + embedding + '/'
+    errors = []
+    with tracing.span('render', network=name, embedding=embedding):
+        points = read_points(name, embedding)
+        for shape in SHAPE_FILES:
+            png_file = directory + shape + '.png'
+            output_key = stamps.key('render', stamps.read(directory))
+            if not os.path.isfile(directory + SHAPE_FILES[shape]) or stamps.is_fresh(png_file, output_key):
+                continue
+            stamps.invalidate(png_file)
+            try:
+                render_shape(shape, directory, points, os.path.basename(name.rstrip('/')))
+            except (QhullError, ValueError):
+                errors.append('{} {}: {}'.format(directory, shape, traceback.format_exc().strip().splitlines()[-1]))
+                continue
+            stamps.write(png_file, output_key)
+    return errors
+
+
+def render_all(jobs, n_jobs=None):
+    """
+    Function to render the shapes of many networks in parallel worker processes.
+    :param jobs: List of (network name, embedding).
+    :param n_jobs: Number of workers, defaults to half of the available cores.
+    :return errors: List of error messages, a failed plot never stops the others.
+    """
+    if n_jobs is None:
+        n_jobs = max(1, int(len(os.sched_getaffinity(0)) / 2))
+    results = Parallel(n_jobs=n_jobs)(delayed(render_network)(name, embedding) for (name, embedding) in jobs)
+    return [error for errors in results for error in errors]
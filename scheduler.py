@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import resource
+import traceback
+import subprocess
+from contextlib import contextmanager
+from joblib import Parallel, delayed
+import stamps
+
+
+def load_manifest(manifest_path):
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest_path, manifest):
+    # write then rename, an interrupted run keeps the previous manifest
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def limit_memory(memory_limit):
+    """
+    Function to cap the address space of the current process, e.g. as a subprocess preexec_fn.
+    :param memory_limit: Limit in bytes, None for no limit.
+    """
+    if memory_limit is not None:
+        soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (int(memory_limit), hard))
+
+
+@contextmanager
+def memory_limited(memory_limit):
+    """
+    Context manager capping the address space of the current worker while one job runs.
+    :param memory_limit: Limit in bytes, None for no limit.
+    """
+    if memory_limit is None:
+        yield
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit_memory(memory_limit)
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+def run_job(func, job, timeout, memory_limit):
+    """
+    Function to run one job and describe its outcome instead of raising.
+    :param func: Called as func(job, timeout, memory_limit), raises on failure.
+    :return record: Dictionary with status, seconds, stderr and worker pid.
+    """
+    start = time.monotonic()
+    record = {'status': 'ok', 'stderr': '', 'pid': os.getpid()}
+    try:
+        func(job, timeout, memory_limit)
+    except (TimeoutError, subprocess.TimeoutExpired):
+        record['status'] = 'timeout'
+        record['stderr'] = traceback.format_exc()[-4000:]
+    except MemoryError:
+        record['status'] = 'out_of_memory'
+        record['stderr'] = traceback.format_exc()[-4000:]
+    except Exception:
+        record['status'] = 'failed'
+        record['stderr'] = traceback.format_exc()[-4000:]
+    record['seconds'] = time.monotonic() - start
+    record['finished'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    return record
+
+
+def schedule(func, jobs, keys, sizes, manifest_path, timeout=None, memory_limit=None, n_jobs=None,
+             output_keys=None):
+    """
+    Function to run jobs longest-first on all cores and record their outcome in a JSON manifest.
+    Jobs whose output is up to date and whose last run succeeded are skipped, failed or stale ones are rerun.
+    :param func: Called as func(job, timeout, memory_limit) in a worker process.
+    :param jobs: The list of jobs.
+    :param keys: Output path of each job, the manifest key.
+    :param sizes: Cost estimate of each job, e.g. its edge count.
+    :param manifest_path: Path to the manifest.
+    :param timeout: Wall-clock limit of one job in seconds.
+    :param memory_limit: Memory limit of one job in bytes.
+    :param n_jobs: Number of workers, defaults to all available cores.
+    :param output_keys: Stamp key of each output, see stamps.key. Without them an existing output is up to date.
+    :return failed: Manifest records of the jobs that did not succeed.
+    """
+    manifest = load_manifest(manifest_path)
+    if output_keys is None:
+        fresh = [os.path.exists(key) for key in keys]
+    else:
+        fresh = [stamps.is_fresh(key, output_key) for key, output_key in zip(keys, output_keys)]
+    pending = [(size, key, job, output_key) for job, key, size, output_key, up_to_date
+               in zip(jobs, keys, sizes, output_keys or [None] * len(jobs), fresh)
+               if not (up_to_date and manifest.get(key, {'status': 'ok'})['status'] == 'ok')]
+    for size, key, job, output_key in pending:
+        stamps.invalidate(key)
+    # largest graphs first, so they do not start last and leave a long tail
+    pending.sort(key=lambda item: -item[0])
+    if n_jobs is None:
+        n_jobs = len(os.sched_getaffinity(0))
+    records = Parallel(n_jobs=n_jobs, batch_size=1)(
+        delayed(run_job)(func, job, timeout, memory_limit) for (size, key, job, output_key) in pending)
+    for (size, key, job, output_key), record in zip(pending, records):
+        record['size'] = int(size)
+        manifest[key] = record
+        if output_key is not None and record['status'] == 'ok':
+            stamps.write(key, output_key)
+    save_manifest(manifest_path, manifest)
+    return {key: manifest[key] for key in keys if manifest.get(key, {'status': 'ok'})['status'] != 'ok'}
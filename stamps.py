@@ -0,0 +1,55 @@
+import os
+import json
+import hashlib
+
+# bump when a change of the code makes earlier outputs wrong, every stamp then changes
+VERSION = 1
+
+
+def key(*parts):
+    """
+    Function to hash the inputs and parameters an output is computed from.
+    :param parts: JSON serializable values, e.g. the stamp of an input file, a method name and a seed.
+    :return key: The hexdigest.
+    """
+    text = json.dumps([VERSION] + list(parts), sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def stamp_path(output_path):
+    return output_path.rstrip('/') + '.stamp'
+
+
+def read(output_path):
+    """
+    Function to read the key an output was computed with.
+    :return key: The key, None if the output or its stamp is missing.
+    """
+    if not os.path.exists(output_path) or not os.path.isfile(stamp_path(output_path)):
+        return None
+    with open(stamp_path(output_path)) as f:
+        return f.read().strip()
+
+
+def is_fresh(output_path, output_key):
+    """
+    Function to check that an output exists and was computed from the same inputs and parameters.
+    """
+    return read(output_path) == output_key
+
+
+def write(output_path, output_key):
+    """
+    Function to record the key of an output once the output is complete.
+    """
+    # write then rename, a stamp that exists is always complete
+    tmp_path = stamp_path(output_path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(output_key + '\n')
+    os.replace(tmp_path, stamp_path(output_path))
+
+
+def invalidate(output_path):
+    # the stamp goes first, an output without a stamp is never reused
+    if os.path.isfile(stamp_path(output_path)):
+        os.remove(stamp_path(output_path))
@@ -0,0 +1,108 @@
+import os
+import json
+import glob
+import time
+import threading
+from contextlib import contextmanager
+
+# set by enable(), worker processes started afterwards inherit it and log to the same directory
+TRACE_ENV = 'NETWORK_SHAPES_TRACE'
+
+
+def enable(trace_dir):
+    """
+    Function to start logging spans of this process and of the worker processes it starts later.
+    :param trace_dir: Directory of the event logs, emptied first.
+    """
+    if not os.path.isdir(trace_dir):
+        os.makedirs(trace_dir)
+    for stale in glob.glob(os.path.join(trace_dir, 'events.*.jsonl')):
+        os.remove(stale)
+    os.environ[TRACE_ENV] = os.path.abspath(trace_dir)
+
+
+def enabled():
+    return bool(os.environ.get(TRACE_ENV))
+
+
+@contextmanager
+def span(name, **fields):
+    """
+    Context manager logging the duration of a stage or job, with its process and thread.
+    Does nothing unless tracing is enabled.
+    :param name: Name of the span, e.g. 'sample' or 'kronfit'.
+    :param fields: Values logged with it, e.g. the proportion or the edge count.
+    :return fields: The dictionary of values, more can be added while the span is open.
+    """
+    if not enabled():
+        yield fields
+        return
+    start = time.time()
+    try:
+        yield fields
+    except BaseException as e:
+        fields['error'] = type(e).__name__
+        raise
+    finally:
+        end = time.time()
+        write_event({'name': name, 'start': start, 'seconds': end - start, 'pid': os.getpid(),
+                     'tid': threading.get_ident(), 'fields': fields})
+
+
+def write_event(event):
+    # one file per process, appends of small lines are never interleaved with another process
+    path = os.path.join(os.environ[TRACE_ENV], 'events.{}.jsonl'.format(os.getpid()))
+    with open(path, 'a') as f:
+        f.write(json.dumps(event, default=str) + '\n')
+
+
+def read_events(trace_dir):
+    events = []
+    for path in glob.glob(os.path.join(trace_dir, 'events.*.jsonl')):
+        with open(path) as f:
+            events += [json.loads(line) for line in f if line.strip()]
+    return sorted(events, key=lambda event: event['start'])
+
+
+def write_chrome_trace(trace_dir, output_path):
+    """
+    Function to merge the event logs of all processes into a Chrome trace, viewable in chrome://tracing or Perfetto.
+    :param trace_dir: Directory of the event logs.
+    :param output_path: Path to the trace JSON.
+    """
+    events = read_events(trace_dir)
+    origin = events[0]['start'] if events else 0
+    trace = [{'name': event['name'], 'ph': 'X', 'ts': (event['start'] - origin) * 1e6,
+              'dur': event['seconds'] * 1e6, 'pid': event['pid'], 'tid': event['tid'], 'args': event['fields']}
+             for event in events]
+    with open(output_path, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+
+def summary(trace_dir):
+    """
+    Function to total the logged spans by name.
+    :return rows: List of (name, count, total seconds, max seconds), slowest first.
+    """
+    totals = {}
+    for event in read_events(trace_dir):
+        count, total, longest = totals.get(event['name'], (0, 0.0, 0.0))
+        totals[event['name']] = (count + 1, total + event['seconds'], max(longest, event['seconds']))
+    return sorted([(name,) + values for name, values in totals.items()], key=lambda row: -row[2])
+
+
+def profiled(stats_path, func, *args, **kwargs):
+    """
+    Function to run func under cProfile and save its statistics, only the calling process is profiled.
+    :param stats_path: Path of the pstats dump, a text report sorted by cumulative time is written next to it.
+    :return result: What func returns.
+    """
+    import cProfile
+    import pstats
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func, *args, **kwargs)
+    finally:
+        profile.dump_stats(stats_path)
+        with open(os.path.splitext(stats_path)[0] + '.txt', 'w') as f:
+            pstats.Stats(profile, stream=f).sort_stats('cumulative').print_stats(50)
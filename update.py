@@ -0,0 +1,259 @@
+'''
+Incremental update of the shapes of an evolving network, e.g. daily snapshots of the same graph.
+Instead of sampling, embedding and fitting the new snapshot from nothing, the changed edges are applied
+to the samples of the previous run:
+
+    python update.py -delta day2.delta [the network_shapes options of the previous run]
+
+The previous run must have used -streaming and a -seed. Its samples keep an edge (randomEdge) or a node
+(randomNode) by a hash of its ids, the seed and (p, i), so whether a new edge or node belongs to a sample
+is decided without resampling. Only the samples the delta touches are rewritten, their WL features are
+recounted around the changed nodes, their Kronecker points are refitted starting from the previous fit
+and the wlsvd points are projected on the saved basis. The hulls are then refitted from the updated points.
+The graph2vec model is trained on all samples at once, so a network with graph2vec points has them
+recomputed from the updated samples.
+
+updates.json lists the applied deltas and the samples each one rewrote, so a later network_shapes.py run
+with the same options finds the updated samples up to date instead of redrawing them from -file.
+
+The delta file has one change per line, tab separated: + or - and the two node ids, e.g.
+    +	12	40
+    -	3	7
+'''
+
+import os
+import copy
+import time
+from functools import partial
+import numpy as np
+from joblib import Parallel, delayed
+from network_shapes import build_parser, run_stage, render, embed, PROFILE_STAGES
+from StreamSampler import StreamSampler
+from Sampler import sample_counts
+from Embedder import Embedder
+from Fitter import Fitter
+from Graph import file_hash
+from scheduler import run_job, load_manifest, save_manifest
+from wlsvd import update_row, load_basis, load_counts, save_counts, count_matrix, project
+import stamps
+import tracing
+
+
+def read_delta(delta_path):
+    """
+    Function to read the changed edges of a network.
+    :param delta_path: Path to the delta file.
+    :return added: Array of shape (m, 2) of the added edges, as (min, max) pairs like the streamed samples.
+    :return removed: Array of shape (m, 2) of the removed edges.
+    """
+    import pandas as pd
+    try:
+        data = pd.read_csv(delta_path, sep='\t', comment='#', header=None, usecols=[0, 1, 2],
+                           dtype={0: str, 1: np.int64, 2: np.int64})
+    except pd.errors.EmptyDataError:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros((0, 2), dtype=np.int64)
+    operations = data[0].str.strip().values
+    if not np.isin(operations, ['+', '-']).all():
+        raise ValueError('Every line of {} must start with + or -'.format(delta_path))
+    edges = np.sort(data[[1, 2]].values, axis=1)
+    return edges[operations == '+'], edges[operations == '-']
+
+
+def edge_keys(edges):
+    # one comparable item per (u, v) pair
+    return np.ascontiguousarray(edges, dtype=np.int64).view(np.dtype((np.void, 16))).ravel()
+
+
+def apply_delta(edges, added, removed):
+    """
+    Function to change the edges of a sample, a removed edge loses every copy of it.
+    :return edges: The int64 edges after the change.
+    """
+    edges = np.asarray(edges, dtype=np.int64)
+    if len(removed):
+        edges = edges[~np.isin(edge_keys(edges), edge_keys(removed))]
+    return np.concatenate([edges, np.asarray(added, dtype=np.int64).reshape(-1, 2)])
+
+
+def update_job(embedder, path, sample_key, added, removed, row, rounds, n_features, kronfit_job, timeout=None,
+               memory_limit=None):
+    """
+    Function to apply the changes of one sample and update its WL features and Kronecker point.
+    :param embedder: The Embedder running the KronFit job.
+    :param path: The sample .npy.
+    :param sample_key: Stamp key of the updated sample.
+    :param added: The added edges that belong to the sample.
+    :param removed: The removed edges that belong to the sample.
+    :param row: hashed_features of the sample before the change, None without wlsvd.
+    :param rounds: Number of WL iterations of the wlsvd basis.
+    :param n_features: Number of hashed features of the wlsvd basis.
+    :param kronfit_job: The KronFit job of the sample, starting from the previous fit if there is one.
+    :return record: The run_job record of the fit.
+    :return row: hashed_features of the sample after the change.
+    """
+    old_edges = np.load(path)
+    edges = apply_delta(old_edges, added, removed)
+    # without changes only the fit is redone, e.g. after it failed in the previous run
+    if len(added) or len(removed):
+        with tracing.span('write_sample', graph=path, edges=len(edges)):
+            stamps.invalidate(path)
+            tmp_path = path[:-len('.npy')] + '.tmp.npy'
+            np.save(tmp_path, edges)
+            os.replace(tmp_path, path)
+            stamps.write(path, sample_key)
+        if row is not None:
+            row = update_row(row, old_edges, edges, np.unique(np.concatenate([added, removed])), rounds,
+                             n_features)
+    stamps.invalidate(kronfit_job[2])
+    record = run_job(partial(embedder.kronfit, edges=edges), kronfit_job, timeout, memory_limit)
+    record['size'] = int(len(edges))
+    return record, row
+
+
+def run_update(args, delta_path, n_jobs=None):
+    """
+    Function to update the samples, points and shapes of a network with the changes of a delta file.
+    :param args: The options of the previous run of the network.
+    :param delta_path: Path to the delta file.
+    :param n_jobs: Number of workers, defaults to all available cores.
+    :return fitters: The Fitters of the updated embeddings.
+    """
+    if not args.streaming or args.seed is None:
+        raise ValueError('Incremental updates need the hashed samples of a run with -streaming and a -seed')
+    sampler = StreamSampler(args)
+    embedder = Embedder(args)
+    directory = args.name + '/'
+    manifest_path = directory + 'kronfit_manifest.json'
+    if n_jobs is None:
+        n_jobs = len(os.sched_getaffinity(0))
+    added, removed = read_delta(delta_path)
+    delta_hash = file_hash(delta_path)
+    # a delta applied twice would add its edges twice, the applied ones are listed in updates.json
+    updates = load_manifest(directory + 'updates.json')
+    if delta_hash in updates:
+        print('{} was already applied, only stale shapes are refitted'.format(delta_path))
+        added, removed = added[:0], removed[:0]
+
+    counts = sample_counts(args)
+    samples = [(p, i, directory + str(p) + '/' + str(i)) for p in counts for i in range(counts[p])]
+    samples.append((100, 0, directory + '100'))
+    for p, i, prefix in samples:
+        if stamps.read(prefix + '.npy') is None:
+            raise ValueError('{}.npy is missing, run network_shapes.py on the network first'.format(prefix))
+
+    wlsvd = os.path.isfile(directory + 'wlsvd_counts.npz') and os.path.isfile(directory + 'wlsvd_basis.npz')
+    rows = load_counts(directory + 'wlsvd_counts.npz') if wlsvd else {}
+    basis, n_features, rounds = load_basis(directory + 'wlsvd_basis.npz') if wlsvd else (None, None, None)
+
+    jobs = []
+    for p, i, prefix in samples:
+        # the hash tests only look at the changed edges, the samples they miss are not read at all
+        sample_added = added if p == 100 else added[sampler.sample_mask(added, p, i)]
+        sample_removed = removed if p == 100 else removed[sampler.sample_mask(removed, p, i)]
+        previous = stamps.read(prefix + '_output.dat')
+        if not len(sample_added) and not len(sample_removed) and previous is not None:
+            continue
+        init = None if previous is None else embedder.read_initiator(prefix + '_output.dat')
+        jobs.append((p, prefix, sample_added, sample_removed, previous,
+                     (prefix + '.npy', prefix + '.edgelist', prefix + '_output.dat', init)))
+    # largest samples first, so they do not start last and leave a long tail
+    jobs.sort(key=lambda job: -job[0])
+    print('Updating {} of {} samples with {} added and {} removed edges'.format(
+        len(jobs), len(samples), len(added), len(removed)))
+
+    sample_keys = [stamps.key('update_sample', stamps.read(prefix + '.npy'), delta_hash)
+                   for p, prefix, sample_added, sample_removed, previous, kronfit_job in jobs]
+    results = Parallel(n_jobs=n_jobs, batch_size=1)(
+        delayed(update_job)(embedder, prefix + '.npy', sample_key, sample_added, sample_removed,
+                            rows.get(prefix + '.npy'), rounds, n_features, kronfit_job, embedder.kronfit_timeout,
+                            embedder.kronfit_memory)
+        for (p, prefix, sample_added, sample_removed, previous, kronfit_job), sample_key in zip(jobs, sample_keys))
+
+    manifest = load_manifest(manifest_path)
+    failed = []
+    for (p, prefix, sample_added, sample_removed, previous, kronfit_job), (record, row) in zip(jobs, results):
+        manifest[kronfit_job[2]] = record
+        if row is not None:
+            rows[prefix + '.npy'] = row
+        if record['status'] == 'ok':
+            # a warm-started refit, a full run of the network redoes it from scratch
+            stamps.write(kronfit_job[2], stamps.key('kronfit_update', stamps.read(prefix + '.npy'), previous,
+                                                    embedder.kronfit_backend, embedder.seed, embedder.kronfit_tol))
+        else:
+            failed.append(kronfit_job[2])
+    save_manifest(manifest_path, manifest)
+    if delta_hash not in updates:
+        # the rewritten samples, in the order of the deltas, give the keys StreamSampler expects for them
+        files = [prefix + '.npy' for p, prefix, sample_added, sample_removed, previous, kronfit_job in jobs
+                 if len(sample_added) or len(sample_removed)]
+        updates[delta_hash] = {'delta': delta_path, 'added': len(added), 'removed': len(removed),
+                               'samples': len(jobs), 'files': files, 'order': len(updates),
+                               'applied': time.strftime('%Y-%m-%d %H:%M:%S')}
+        save_manifest(directory + 'updates.json', updates)
+    if failed:
+        raise RuntimeError('Kronfit failed for {} graphs ({}), see {}. Rerun to retry them.'.format(
+            len(failed), ', '.join(sorted(failed)), manifest_path))
+
+    args = copy.copy(args)
+    args.embedding = 'kroneckerPoint'
+    embedded = [(copy.copy(args), Embedder(args).kron_points())]
+    if wlsvd:
+        args.embedding = 'wlsvd'
+        embedded.append((copy.copy(args), update_wlsvd(args, rows, basis, rounds, n_features)))
+    if os.path.isfile(directory + 'g2v_points.txt'):
+        args.embedding = 'graph2vec'
+        embedded.append((copy.copy(args), embed(args)))
+    fitters = []
+    for embedding_args, points in embedded:
+        fitters.append(Fitter(embedding_args))
+        run_stage(embedding_args, 'fit', fitters[-1].fit, points)
+    return fitters
+
+
+def update_wlsvd(args, rows, basis, rounds, n_features):
+    """
+    Function to project the updated WL features of all samples on the saved wlsvd basis. The basis is not
+    refitted, so the points of the snapshots share their coordinates.
+    :param rows: Dictionary sample file -> hashed_features, updated for the changed samples.
+    :return points: List of [x1, x2, x3, sampling_proportion].
+    """
+    directory = args.name + '/'
+    counts = sample_counts(args)
+    files = [directory + str(p) + '/' + str(i) + '.npy' for p in counts for i in range(counts[p])]
+    files.append(directory + '100.npy')
+    proportions = [p for p in counts for i in range(counts[p])] + [100]
+
+    # graphs sampled since the counts were saved are counted in full
+    X = count_matrix(files, rounds, n_features, rows)
+    save_counts(directory + 'wlsvd_counts.npz', X, files)
+    output_path = directory + 'wlsvd_points.txt'
+    output_key = stamps.key('wlsvd_update', stamps.read(output_path), [(f, stamps.read(f)) for f in files])
+    stamps.invalidate(output_path)
+    points = []
+    with open(output_path, 'w') as f:
+        f.write('x1,x2,x3,sampling_proportion\n')
+        for (x1, x2, x3), p in zip(project(X, basis), proportions):
+            f.write('{},{},{},{}\n'.format(x1, x2, x3, p))
+            points.append([float(x1), float(x2), float(x3), float(p)])
+    stamps.write(output_path, output_key)
+    return points
+
+
+if __name__ == '__main__':
+    parser = build_parser(PROFILE_STAGES + ['update'])
+    parser.description = 'Updating the 3D Network Shapes of a network with changed edges'
+    parser.add_argument('-delta', required=True,
+                        help='Tab separated changes of the edge list, one per line: + or - and the two node ids')
+    args = parser.parse_args()
+    directory = args.name + '/'
+    if args.trace:
+        tracing.enable(directory + 'trace/')
+
+    fitters = run_stage(args, 'update', run_update, args, args.delta)
+    for error in render(args, fitters):
+        print('Rendering failed: {}'.format(error))
+    for fitter in fitters:
+        fitter.zip_shapes()
+
+    if args.trace:
+        tracing.write_chrome_trace(directory + 'trace/', directory + 'trace.json')
@@ -0,0 +1,269 @@
+import os
+import numpy as np
+import scipy.sparse as sp
+from tqdm import tqdm
+from joblib import Parallel, delayed
+from Graph import Graph, mix64
+from Sampler import sample_counts
+import tracing
+import stamps
+from graph2vec import WeisfeilerLehmanMachine, dataset_reader, read_points
+
+# known_rows handed to run_wlsvd must be counted with these
+WL_ITERATIONS = 2
+N_FEATURES = 2 ** 18
+
+
+def hashed_features(path, rounds, n_features, edges=None):
+    """
+    Function to count the WL tokens of a graph into hashed feature buckets.
+    :param path: The path to the graph .npy.
+    :param rounds: Number of WL iterations.
+    :param n_features: Number of buckets, a power of two.
+    :param edges: The edges of the graph if they are already in memory, then the file is not read.
+    :return buckets: Sorted bucket indices with a non-zero count.
+    :return counts: Token count of each bucket.
+    """
+    with tracing.span('wl_features', graph=path) as span:
+        graph, features, name = dataset_reader(path, edges)
+        span.update(nodes=graph.n, edges=graph.m)
+        machine = WeisfeilerLehmanMachine(graph, features, rounds)
+    return bucket_counts(machine.labels, n_features)
+
+
+def bucket_counts(labels, n_features):
+    """
+    Function to count WL labels into hashed feature buckets.
+    :param labels: List of label arrays, one per WL level.
+    :param n_features: Number of buckets, a power of two.
+    :return buckets: Sorted bucket indices with a non-zero count.
+    :return counts: Token count of each bucket.
+    """
+    # the level is part of the hash, a degree token never collides with a WL label on purpose
+    labels = np.concatenate([mix64(level_labels ^ mix64(np.uint64(level)))
+                             for level, level_labels in enumerate(labels)])
+    buckets = (labels & np.uint64(n_features - 1)).astype(np.int64)
+    return np.unique(buckets, return_counts=True)
+
+
+def local_features(edges, changed, rounds, n_features):
+    """
+    Function to count the WL tokens of the nodes at most `rounds` hops from the changed nodes, the only
+    nodes whose labels an edge change can move. Their labels are computed on the ball of 2 * rounds hops,
+    with the degrees in the whole graph as initial features, which gives them the labels they have in the
+    whole graph without labeling the rest of it.
+    :param edges: The edges of the graph, with the node ids of the sample file.
+    :param changed: Node ids with an added or removed edge.
+    :param rounds: Number of WL iterations.
+    :param n_features: Number of buckets, a power of two.
+    :return buckets: Sorted bucket indices with a non-zero count.
+    :return counts: Token count of each bucket.
+    """
+    edges = np.asarray(edges)
+    hops = [np.unique(changed)]
+    ball = hops[0]
+    for hop in range(2 * rounds + 1):
+        incident = edges[np.isin(edges[:, 0], ball) | np.isin(edges[:, 1], ball)]
+        if hop < 2 * rounds:
+            hops.append(np.setdiff1d(incident, ball))
+            ball = np.union1d(ball, hops[-1])
+    # every edge of a ball node is incident, so these degrees are those of the whole graph
+    graph = Graph.from_edges(incident)
+    in_ball = np.isin(graph.node_ids, ball)
+    machine = WeisfeilerLehmanMachine(Graph(graph.induced_edges(in_ball), graph.node_ids), graph.degree(), rounds)
+    inner = np.isin(graph.node_ids, np.concatenate(hops[:rounds + 1]))
+    return bucket_counts([level_labels[inner] for level_labels in machine.labels], n_features)
+
+
+def update_row(row, old_edges, new_edges, changed, rounds, n_features):
+    """
+    Function to update the hashed WL features of a graph after some of its edges changed.
+    :param row: hashed_features of the graph before the change.
+    :param old_edges: The edges before the change.
+    :param new_edges: The edges after the change.
+    :param changed: Node ids with an added or removed edge.
+    :return row: hashed_features of the graph after the change.
+    """
+    with tracing.span('wl_update', nodes=len(changed)):
+        old_buckets, old_counts = local_features(old_edges, changed, rounds, n_features)
+        new_buckets, new_counts = local_features(new_edges, changed, rounds, n_features)
+    buckets, position = np.unique(np.concatenate([row[0], old_buckets, new_buckets]), return_inverse=True)
+    counts = np.bincount(position, np.concatenate([row[1], -old_counts, new_counts]), len(buckets))
+    counts = np.rint(counts).astype(np.int64)
+    return buckets[counts != 0], counts[counts != 0]
+
+
+def count_matrix(files, rounds, n_features, known_rows=None):
+    """
+    Function to build the sparse graphs x hashed WL feature count matrix.
+    :param files: The list of graph files.
+    :param rounds: Number of WL iterations.
+    :param n_features: Number of hashed features.
+    :param known_rows: Optional dictionary file -> hashed_features of graphs already counted.
+    :return X: The csr count matrix.
+    """
+    known_rows = known_rows or {}
+    missing = [f for f in files if f not in known_rows]
+    counted = Parallel(n_jobs=max(1, int(len(os.sched_getaffinity(0)) / 2)))(
+        delayed(hashed_features)(f, rounds, n_features) for f in tqdm(missing))
+    known_rows = dict(known_rows, **dict(zip(missing, counted)))
+    rows = [known_rows[f] for f in files]
+    indptr = np.cumsum([0] + [len(buckets) for buckets, counts in rows])
+    indices = np.concatenate([buckets for buckets, counts in rows])
+    data = np.concatenate([counts for buckets, counts in rows]).astype(float)
+    return sp.csr_matrix((data, indices, indptr), shape=(len(files), n_features))
+
+
+def tfidf(X, idf):
+    """
+    Function to apply TF-IDF weighting and l2 row normalization.
+    :param X: The csr count matrix.
+    :param idf: Inverse document frequency of each column.
+    :return X: The weighted csr matrix.
+    """
+    X = sp.csr_matrix(X.multiply(idf[None, :]))
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sp.csr_matrix(X.multiply(1 / norms[:, None]))
+
+
+def randomized_svd(X, k, rng, n_oversamples=10, n_iter=4):
+    """
+    Function to compute a truncated SVD with the randomized range finder of Halko et al.
+    :param X: Sparse or dense matrix.
+    :param k: Number of components.
+    :param rng: The numpy random Generator.
+    :param n_oversamples: Extra random directions for the range finder.
+    :param n_iter: Number of power iterations.
+    :return U, S, Vt: The truncated factors, with deterministic signs.
+    """
+    size = min(k + n_oversamples, min(X.shape))
+    Q = X @ rng.standard_normal((X.shape[1], size))
+    for _ in range(n_iter):
+        Q, _ = np.linalg.qr(Q)
+        Q = X @ (X.T @ Q)
+    Q, _ = np.linalg.qr(Q)
+    B = np.asarray((X.T @ Q).T)
+    Uh, S, Vt = np.linalg.svd(B, full_matrices=False)
+    U = Q @ Uh
+    U, S, Vt = U[:, :k], S[:k], Vt[:k]
+    # the largest loading of each component is positive, so the basis does not flip between runs
+    signs = np.sign(Vt[np.arange(len(Vt)), np.abs(Vt).argmax(axis=1)])
+    return U * signs, S, Vt * signs[:, None]
+
+
+def fit_basis(X, dimensions, rng):
+    """
+    Function to fit the TF-IDF weights and the projection basis on a count matrix.
+    :param X: The csr count matrix.
+    :param dimensions: Embedding dimension.
+    :param rng: The numpy random Generator.
+    :return basis: Dictionary with the used columns, their idf and the components.
+    """
+    # only columns seen in the training graphs matter, the random test matrix stays small
+    columns = np.unique(X.indices)
+    X = X[:, columns]
+    df = np.bincount(X.indices, minlength=X.shape[1])
+    idf = np.log((1 + X.shape[0]) / (1 + df)) + 1
+    with tracing.span('svd', graphs=X.shape[0], features=len(columns)):
+        U, S, Vt = randomized_svd(tfidf(X, idf), dimensions, rng)
+    components = np.zeros((dimensions, len(columns)))
+    components[:len(Vt)] = Vt
+    return {'columns': columns, 'idf': idf, 'components': components}
+
+
+def project(X, basis):
+    """
+    Function to project graphs on an existing basis, without refitting it.
+    :param X: The csr count matrix over all hashed features.
+    :param basis: Dictionary returned by fit_basis.
+    :return points: Array of shape (graphs, dimensions).
+    """
+    X = tfidf(X[:, basis['columns']], basis['idf'])
+    return np.asarray(X @ basis['components'].T)
+
+
+def save_basis(path, basis, n_features, wl_iterations):
+    np.savez(path, n_features=n_features, wl_iterations=wl_iterations, **basis)
+
+
+def load_basis(path):
+    data = np.load(path)
+    basis = {key: data[key] for key in ['columns', 'idf', 'components']}
+    return basis, int(data['n_features']), int(data['wl_iterations'])
+
+
+def save_counts(path, X, files):
+    np.savez(path, data=X.data, indices=X.indices, indptr=X.indptr, shape=X.shape, files=np.asarray(files, dtype=str))
+
+
+def load_counts(path):
+    """
+    Function to read the count matrix of a network back as rows.
+    :return rows: Dictionary file -> (buckets, counts), as returned by hashed_features.
+    """
+    data = np.load(path)
+    indptr = data['indptr']
+    return {f: (data['indices'][start:end].astype(np.int64), data['data'][start:end].astype(np.int64))
+            for f, start, end in zip(data['files'].tolist(), indptr[:-1], indptr[1:])}
+
+
+def project_files(basis_path, files):
+    """
+    Function to embed new graphs with a saved basis.
+    :param basis_path: Path to the wlsvd_basis.npz of a network.
+    :param files: The list of graph files.
+    :return points: Array of shape (graphs, dimensions).
+    """
+    basis, n_features, wl_iterations = load_basis(basis_path)
+    return project(count_matrix(files, wl_iterations, n_features), basis)
+
+
+def run_wlsvd(args, known_rows=None):
+    """
+    Main function to embed the samples with hashed WL features, TF-IDF and randomized SVD.
+    :param args: Object with the arguments.
+    :param known_rows: Optional dictionary file -> hashed_features of samples already counted.
+    :return points: List of [x1, x2, x3, sampling_proportion].
+    """
+    directory = args.name + '/'
+
+    dimensions = 3
+    wl_iterations = WL_ITERATIONS
+    n_features = N_FEATURES
+    seed = 0 if args.seed is None else int(args.seed)
+
+    counts = sample_counts(args)
+    files = []
+    proportions = []
+    for p in counts:
+        graphs = [directory + str(p) + '/' + str(i) + '.npy' for i in range(counts[p])]
+        files += graphs
+        proportions += [p] * len(graphs)
+    files.append(directory + "100.npy")
+    proportions.append(100)
+
+    output_path = directory + "wlsvd_points.txt"
+    output_key = stamps.key('wlsvd', dimensions, wl_iterations, n_features, seed,
+                            [(f, stamps.read(f)) for f in files])
+    if stamps.is_fresh(output_path, output_key) and os.path.isfile(directory + "wlsvd_basis.npz"):
+        print("\nwlsvd points are up to date.\n")
+        return read_points(output_path)
+    stamps.invalidate(output_path)
+
+    print("\nFeature extraction started.\n")
+    X = count_matrix(files, wl_iterations, n_features, known_rows)
+    basis = fit_basis(X, dimensions, np.random.default_rng(seed))
+    save_basis(directory + "wlsvd_basis.npz", basis, n_features, wl_iterations)
+    # kept for incremental updates, which only recount the graphs that changed
+    save_counts(directory + "wlsvd_counts.npz", X, files)
+    embedding = project(X, basis)
+
+    points = []
+    with open(output_path, 'w') as f:
+        f.write('x1,x2,x3,sampling_proportion\n')
+        for (x1, x2, x3), p in zip(embedding, proportions):
+            f.write('{},{},{},{}\n'.format(x1, x2, x3, p))
+            points.append([float(x1), float(x2), float(x3), float(p)])
+    stamps.write(output_path, output_key)
+    return points